@@ -1,32 +1,74 @@
-from flask import Flask, g
-from flasgger import Swagger
+import json
+import os
+from flask import Flask
 from flask import jsonify
 from routes.routes import auth_bp
 from routes.routes import dashboard_bp
 from routes.routes import dutch_bp
-from models.db import Database
+import metrics
+from models.db import init_app as init_database
+from models.hashing import init_app as init_hashing
+from middleware.profiling import init_app as init_profiling
 from extensions import limiter
 from flask_limiter.errors import RateLimitExceeded
 
-app = Flask(__name__) 
-swagger = Swagger(app)
 
-limiter.init_app(app)
+def create_app(config=None):
+    """ Build the app. Nothing here opens a database connection, the pools connect on first use. """
+    app = Flask(__name__)
 
-app.register_blueprint(auth_bp)
-app.register_blueprint(dashboard_bp)
-app.register_blueprint(dutch_bp)
+    # counters live in a sqlite file so every worker process on the host shares the same budget
+    app.config["RATELIMIT_STORAGE_URI"] = os.environ.get("RATELIMIT_STORAGE_URI", "sqlite:///limiter.db")
+    app.config["RATELIMIT_STRATEGY"] = "sliding-window-counter"
+    # workers that don't serve /apidocs can skip flasgger entirely
+    app.config["SWAGGER_ENABLED"] = os.environ.get("SWAGGER_ENABLED", "1") != "0"
+    # written by build_apispec.py, served as is instead of parsing every view docstring
+    app.config["SWAGGER_SPEC_FILE"] = "apispec.json"
+    if config:
+        app.config.update(config)
+
+    if app.config["SWAGGER_ENABLED"]:
+        init_swagger(app)
+
+    metrics.init_app(app)
+    limiter.init_app(app)
+    init_database(app)
+    init_hashing(app)
+
+    app.register_blueprint(auth_bp)
+    app.register_blueprint(dashboard_bp)
+    app.register_blueprint(dutch_bp)
+    # wraps the views registered above, a no-op unless PROFILE_DIR is set
+    init_profiling(app)
+
+    app.register_error_handler(RateLimitExceeded, ratelimit_handler)
+    return app
+
+
+def init_swagger(app):
+    from flasgger import Swagger
+
+    # flasgger builds the spec on the first /apispec_1.json request and caches it (outside debug mode)
+    swagger = Swagger(app)
+    spec_file = app.config["SWAGGER_SPEC_FILE"]
+    if spec_file:
+        path = os.path.join(app.root_path, spec_file)
+        if os.path.exists(path):
+            with open(path) as f:
+                # prefilling that cache means the docstrings are never parsed at all
+                swagger.apispecs.update(json.load(f))
+    return swagger
 
 
-@app.errorhandler(RateLimitExceeded)
 def ratelimit_handler(e):
+    metrics.record_rate_limited()
     return jsonify({"error": "Rate limit exceeded. Please wait."}), 429
 
 # @app.route('/', methods=['GET']) 
 # def home():
 #     return "Welcome"
 
-db = Database("file.db")
-    
+app = create_app()
+
 if __name__ == '__main__':
-    app.run(debug = True, port=5001)
\ No newline at end of file
+    app.run(debug = True, port=5001)
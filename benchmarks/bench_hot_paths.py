@@ -0,0 +1,187 @@
+""" Ops/s and p50/p99 latency of the hot model paths against a synthetic database, with JSON baselines.
+
+Run from the project root:
+    python -m benchmarks.bench_hot_paths --save benchmarks/baselines/main.json
+    python -m benchmarks.bench_hot_paths --compare benchmarks/baselines/main.json   # exits 1 on a regression
+Each call runs in its own app context, like a request: pool checkout and teardown are part of the time.
+Pass --database to reuse a file made by benchmarks.datagen instead of generating one per run.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from app import create_app
+from benchmarks import datagen
+from middleware.auth import verify_token, verified_tokens
+from models.auth import Users
+from models.chart import Chart
+from models.db import get_db
+from models.dutch import Dutch
+from models.transaction import Transaction
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def measure(app, operation, seconds, max_ops, warmup=5):
+    """ Call operation(rnd) until the time or the call budget runs out, returns ops/s, p50 and p99 in ms. """
+    rnd = random.Random(7)
+    for _ in range(warmup):
+        with app.app_context():
+            operation(rnd)
+
+    latencies = []
+    stop = time.perf_counter() + seconds
+    while time.perf_counter() < stop and len(latencies) < max_ops:
+        started = time.perf_counter()
+        with app.app_context():
+            operation(rnd)
+        latencies.append(time.perf_counter() - started)
+    return {
+        "ops_per_sec": round(len(latencies) / sum(latencies), 1),
+        "p50_ms": round(percentile(latencies, 0.5) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "samples": len(latencies),
+    }
+
+
+def hot_paths(users, groups):
+    """ name -> operation(rnd), every one picks its user or group from rnd so runs are repeatable. """
+    tokens = [f"Bearer {Users.generate_token(user_id)}" for user_id in range(1, min(users, 500) + 1)]
+
+    def transactions_page(rnd):
+        Transaction().get_transactions(rnd.randint(1, users))
+
+    def transactions_filtered(rnd):
+        Transaction().get_transactions(rnd.randint(1, users), limit=50, date_from="2024-01-01", category_id=rnd.randint(3, 7))
+
+    def chart_compare(rnd):
+        Chart().format_chart_data(rnd.randint(1, users))
+
+    def dutch_calculation(rnd):
+        group_id, created_by = rnd.choice(groups)
+        Dutch().calculation(created_by, group_id)
+
+    def login(rnd):
+        Users().login_user(datagen.username(rnd.randint(1, users)), datagen.PASSWORD)
+
+    def verify_token_cached(rnd):
+        verify_token(rnd.choice(tokens))
+
+    def verify_token_uncached(rnd):
+        # signature check and user lookup every time
+        verified_tokens.clear()
+        verify_token(rnd.choice(tokens))
+
+    return {
+        "Transaction.get_transactions": transactions_page,
+        "Transaction.get_transactions filtered": transactions_filtered,
+        "Chart.format_chart_data": chart_compare,
+        "Dutch.calculation": dutch_calculation,
+        "Users.login_user": login,
+        "verify_token cached": verify_token_cached,
+        "verify_token uncached": verify_token_uncached,
+    }
+
+
+def run(path, seconds, max_ops, only=None):
+    app = create_app({
+        "DATABASE": path,
+        "RATELIMIT_ENABLED": False,
+        "SWAGGER_ENABLED": False,
+    })
+    with app.app_context():
+        db = get_db()
+        users = db.fetch_one("SELECT COUNT(*) FROM users", ())[0]
+        groups = [(row["id"], row["created_by"]) for row in db.fetch_all("SELECT id, created_by FROM groups ORDER BY id")]
+    results = {}
+    for name, operation in hot_paths(users, groups).items():
+        if only and not any(part in name for part in only):
+            continue
+        results[name] = measure(app, operation, seconds, max_ops)
+        print(f"{name:<42}{results[name]['ops_per_sec']:>12.1f}{results[name]['p50_ms']:>12.3f}"
+              f"{results[name]['p99_ms']:>12.3f}{results[name]['samples']:>10}")
+    return results
+
+
+def compare(results, baseline, threshold):
+    """ Print the change against a baseline, returns the names that got slower than `threshold` allows. """
+    regressions = []
+    print(f"\n{'vs baseline':<42}{'ops/s':>12}{'p50':>12}{'p99':>12}")
+    for name, result in results.items():
+        old = baseline["results"].get(name)
+        if old is None:
+            print(f"{name:<42}{'new':>12}")
+            continue
+        ops = result["ops_per_sec"] / old["ops_per_sec"] - 1
+        p50 = result["p50_ms"] / old["p50_ms"] - 1 if old["p50_ms"] else 0.0
+        p99 = result["p99_ms"] / old["p99_ms"] - 1 if old["p99_ms"] else 0.0
+        # p99 is too noisy on a shared machine to fail a run on its own
+        slower = p50 > threshold or ops < -threshold
+        print(f"{name:<42}{ops:>+12.1%}{p50:>+12.1%}{p99:>+12.1%}{'  REGRESSION' if slower else ''}")
+        if slower:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database", help="reuse a database made by benchmarks.datagen")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--transactions", type=int, default=200000)
+    parser.add_argument("--groups", type=int, default=500)
+    parser.add_argument("--seconds", type=float, default=3, help="per benchmark")
+    parser.add_argument("--max-ops", type=int, default=20000, help="per benchmark")
+    parser.add_argument("--only", action="append", help="run benchmarks whose name contains this, repeatable")
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="baseline JSON file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed slowdown before --compare fails")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = args.database
+        data = {"database": path}
+        if path is None:
+            path = os.path.join(tmp, "bench.db")
+            data = {"users": args.users, "transactions": args.transactions, "groups": args.groups, "seed": 42}
+            counts = datagen.generate(path, args.users, args.transactions, args.groups)
+            print(", ".join(f"{count} {table}" for table, count in counts.items()))
+        if baseline is not None and baseline["data"] != data:
+            print(f"warning: the baseline was measured on different data: {baseline['data']}")
+
+        print(f"{'benchmark':<42}{'ops/s':>12}{'p50 ms':>12}{'p99 ms':>12}{'samples':>10}")
+        results = run(path, args.seconds, args.max_ops, args.only)
+
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, "w") as f:
+            json.dump({
+                "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "python": platform.python_version(),
+                "sqlite": sqlite3.sqlite_version,
+                "machine": platform.machine(),
+                "data": data,
+                "results": results,
+            }, f, indent=2)
+        print(f"\nSaved to {args.save}")
+
+    if baseline is not None and compare(results, baseline, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+""" Cost of one rate limit check per storage and strategy, and whether a limit holds across worker processes.
+
+Run from the project root:  python -m benchmarks.bench_limiter --hits 20000 --processes 4
+"""
+import argparse
+import multiprocessing
+import os
+import tempfile
+import time
+from limits import parse
+from limits.storage import storage_from_string
+from limits.strategies import FixedWindowRateLimiter, SlidingWindowCounterRateLimiter
+import middleware.limiter_storage  # registers sqlite://
+
+STRATEGIES = {
+    "fixed-window": FixedWindowRateLimiter,
+    "sliding-window-counter": SlidingWindowCounterRateLimiter,
+}
+
+
+def per_hit(uri, strategy, hits, keys):
+    limiter = STRATEGIES[strategy](storage_from_string(uri))
+    item = parse("1000000 per hour")
+    started = time.perf_counter()
+    for index in range(hits):
+        limiter.hit(item, "bench", str(index % keys))
+    return (time.perf_counter() - started) / hits * 1e6
+
+
+def worker(uri, strategy, limit, hits, results):
+    # a fresh process, like a gunicorn worker, with its own storage object
+    limiter = STRATEGIES[strategy](storage_from_string(uri))
+    item = parse(f"{limit} per hour")
+    results.put(sum(1 for _ in range(hits) if limiter.hit(item, "shared", "login")))
+
+
+def allowed_across(uri, strategy, processes, limit):
+    results = multiprocessing.Queue()
+    workers = [
+        multiprocessing.Process(target=worker, args=(uri, strategy, limit, limit, results))
+        for _ in range(processes)
+    ]
+    for process in workers:
+        process.start()
+    allowed = sum(results.get() for _ in workers)
+    for process in workers:
+        process.join()
+    return allowed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--hits", type=int, default=20000)
+    parser.add_argument("--keys", type=int, default=500)
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--limit", type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        sqlite_uri = "sqlite:////" + os.path.join(tmp, "limiter.db").lstrip("/")
+        storages = [("memory", "memory://"), ("sqlite", sqlite_uri)]
+
+        print(f"{'storage':<10}{'strategy':<26}{'us/hit':>10}{'allowed':>10}{'expected':>10}")
+        for name, uri in storages:
+            for strategy in STRATEGIES:
+                cost = per_hit(uri, strategy, args.hits, args.keys)
+                # every process tries `limit` hits on one key, a shared store lets `limit` through in total
+                allowed = allowed_across(uri, strategy, args.processes, args.limit)
+                print(f"{name:<10}{strategy:<26}{cost:>10.1f}{allowed:>10}{args.limit:>10}")
+                storage_from_string(uri).reset()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+""" Login throughput and latency of cheap reads running next to a login burst, for several hashing pool sizes.
+
+Run from the project root:  python -m benchmarks.bench_login --seconds 5 --clients 16 --sizes 1,2,4,8
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+from models.auth import Users
+from models.db import Database, ConnectionPool, PRAGMA_PROFILE
+from models.hashing import PasswordHasher, HashingBusy
+from models.migrations import migrate
+import models.hashing
+
+PASSWORD = "secret123"
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def run(path, seconds, clients, readers, users):
+    pool = ConnectionPool(path, size=clients + readers, pragmas=PRAGMA_PROFILE)
+    counts = {"logins": 0, "busy": 0, "errors": 0}
+    read_latencies = []
+    lock = threading.Lock()
+    stop = time.perf_counter() + seconds
+
+    def client(index):
+        done = busy = errors = 0
+        while time.perf_counter() < stop:
+            db = Database(pool=pool)
+            try:
+                Users(db).login_user(f"bench{index % users}", PASSWORD)
+                done += 1
+            except HashingBusy:
+                busy += 1
+                time.sleep(0.01)
+            except Exception:
+                errors += 1
+            finally:
+                db.close()
+        with lock:
+            counts["logins"] += done
+            counts["busy"] += busy
+            counts["errors"] += errors
+
+    def reader():
+        # stands in for dashboard requests served by the same process
+        latencies = []
+        while time.perf_counter() < stop:
+            started = time.perf_counter()
+            db = Database(pool=pool)
+            try:
+                db.fetch_one("SELECT COUNT(*) FROM users", ())
+            finally:
+                db.close()
+            latencies.append(time.perf_counter() - started)
+            time.sleep(0.005)
+        with lock:
+            read_latencies.extend(latencies)
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    threads += [threading.Thread(target=reader) for _ in range(readers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    pool.close_all()
+    return counts, read_latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--readers", type=int, default=2)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--rounds", type=int, default=10)
+    parser.add_argument("--max-pending", type=int, default=32)
+    parser.add_argument("--sizes", default="1,2,4,8")
+    args = parser.parse_args()
+
+    print(f"{'workers':<10}{'logins/s':>10}{'busy':>8}{'errors':>8}{'avg wait ms':>13}{'read p50 ms':>13}{'read p99 ms':>13}")
+    for size in [int(value) for value in args.sizes.split(",")]:
+        hasher = PasswordHasher(workers=size, max_pending=args.max_pending, rounds=args.rounds)
+        # Users picks the hasher up through get_hasher(), outside an app that is the module default
+        models.hashing._default_hasher = hasher
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "bench.db")
+            db = Database(path)
+            migrate(db)
+            for index in range(args.users):
+                Users(db).create_user(f"bench{index}", f"bench{index}@example.com", PASSWORD)
+            db.close()
+            counts, reads = run(path, args.seconds, args.clients, args.readers, args.users)
+        stats = hasher.stats()
+        hasher.shutdown()
+        print(f"{size:<10}{counts['logins'] / args.seconds:>10.1f}{counts['busy']:>8}{counts['errors']:>8}"
+              f"{stats['avg_wait_ms']:>13.1f}{percentile(reads, 0.5) * 1000:>13.2f}{percentile(reads, 0.99) * 1000:>13.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+""" Mixed read/write throughput with the default sqlite settings vs PRAGMA_PROFILE and the read/write split.
+
+Run from the project root:  python -m benchmarks.bench_pragmas --seconds 5 --readers 4 --writers 2
+"""
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+from models.db import Database, ConnectionPool, PRAGMA_PROFILE
+
+SCHEMA = """
+CREATE TABLE transactions(
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    category_id INTEGER NOT NULL,
+    amount REAL NOT NULL,
+    description TEXT,
+    date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+)
+"""
+
+READ_QUERY = "SELECT category_id, SUM(amount) AS total_amount FROM transactions WHERE user_id = ? GROUP BY category_id"
+WRITE_QUERY = "INSERT INTO transactions(user_id, category_id, amount, description) VALUES (?, ?, ?, ?)"
+
+
+def seed(path, rows, users):
+    db = Database(path)
+    db.execute(SCHEMA)
+    rnd = random.Random(42)
+    db.connection.executemany(
+        WRITE_QUERY,
+        [(rnd.randint(1, users), rnd.randint(1, 7), rnd.uniform(-200, 200), "seed") for _ in range(rows)],
+    )
+    db.connection.commit()
+    db.close()
+
+
+def run(path, pragmas, split, seconds, readers, writers, users):
+    pool = ConnectionPool(path, size=readers + writers, pragmas=pragmas)
+    read_pool = ConnectionPool(path, size=readers, pragmas=pragmas, readonly=True) if split else None
+    counts = {"reads": 0, "writes": 0, "errors": 0}
+    lock = threading.Lock()
+    stop = time.perf_counter() + seconds
+
+    def reader(seed_value):
+        rnd = random.Random(seed_value)
+        done = errors = 0
+        while time.perf_counter() < stop:
+            db = Database(pool=pool, read_pool=read_pool)
+            try:
+                db.fetch_all(READ_QUERY, (rnd.randint(1, users),))
+                done += 1
+            except Exception:
+                errors += 1
+            finally:
+                db.close()
+        with lock:
+            counts["reads"] += done
+            counts["errors"] += errors
+
+    def writer(seed_value):
+        rnd = random.Random(seed_value)
+        done = errors = 0
+        while time.perf_counter() < stop:
+            db = Database(pool=pool, read_pool=read_pool)
+            try:
+                db.execute(WRITE_QUERY, (rnd.randint(1, users), rnd.randint(1, 7), rnd.uniform(-200, 200), "bench"))
+                done += 1
+            except Exception:
+                errors += 1
+            finally:
+                db.close()
+        with lock:
+            counts["writes"] += done
+            counts["errors"] += errors
+
+    threads = [threading.Thread(target=reader, args=(i,)) for i in range(readers)]
+    threads += [threading.Thread(target=writer, args=(100 + i,)) for i in range(writers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    pool.close_all()
+    if read_pool is not None:
+        read_pool.close_all()
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--writers", type=int, default=2)
+    parser.add_argument("--rows", type=int, default=50000)
+    parser.add_argument("--users", type=int, default=200)
+    args = parser.parse_args()
+
+    # busy_timeout is kept in the baseline so it measures throughput, not how fast writers give up
+    scenarios = [
+        ("default journal", {"busy_timeout": 5000}, False),
+        ("PRAGMA_PROFILE", PRAGMA_PROFILE, False),
+        ("PRAGMA_PROFILE + read/write split", PRAGMA_PROFILE, True),
+    ]
+
+    print(f"{'scenario':<36}{'reads/s':>12}{'writes/s':>12}{'errors':>8}")
+    for name, pragmas, split in scenarios:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "bench.db")
+            seed(path, args.rows, args.users)
+            counts = run(path, pragmas, split, args.seconds, args.readers, args.writers, args.users)
+        print(f"{name:<36}{counts['reads'] / args.seconds:>12.0f}{counts['writes'] / args.seconds:>12.0f}{counts['errors']:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+""" Deterministic synthetic data for the benchmarks: users, their own categories, transactions and dutch groups.
+
+The same arguments always give the same database, so numbers from different runs (and baselines) compare.
+Run from the project root:  python -m benchmarks.datagen bench.db --users 2000 --transactions 2000000
+"""
+import argparse
+import datetime
+import os
+import random
+import time
+import bcrypt
+from models.db import Database
+from models.migrations import migrate
+
+PASSWORD = "secret123"
+# hashing every user's password would take longer than the rest of the load, they all share one hash
+BCRYPT_ROUNDS = 10
+START_DATE = datetime.datetime(2023, 1, 1)
+DAYS = 730
+BATCH = 50000
+
+# the global categories of the initial migration, ids 1-7
+INCOME_CATEGORIES = (1, 2)
+EXPENSE_CATEGORIES = (3, 4, 5, 6, 7)
+DESCRIPTIONS = ("groceries", "rent", "bus ticket", "cinema", "shoes", "salary", "birthday", None)
+
+
+def username(index):
+    return f"user{index}"
+
+
+def _batches(rows, size=BATCH):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _users(count, password_hash):
+    for index in range(1, count + 1):
+        yield (index, username(index), f"{username(index)}@example.com", password_hash)
+
+
+def _categories(rnd, users, per_user):
+    # personal categories get ids after the 7 global ones
+    next_id = 8
+    own = {}
+    rows = []
+    for user_id in range(1, users + 1):
+        for number in range(rnd.randint(0, per_user)):
+            category_type = rnd.choice(("income", "expense"))
+            rows.append((next_id, f"custom {number}", category_type, user_id))
+            own[user_id] = own.get(user_id, []) + [(next_id, category_type)]
+            next_id += 1
+    return rows, own
+
+
+def _transactions(rnd, users, count, own_categories):
+    # users get uneven shares like real ones: a few heavy users, a long tail of light ones
+    weights = [1 / (rank ** 0.8) for rank in range(1, users + 1)]
+    scale = count / sum(weights)
+    shares = [int(weight * scale) for weight in weights]
+    shares[0] += count - sum(shares)
+    rnd.shuffle(shares)
+
+    for user_id, share in enumerate(shares, start=1):
+        # each user's rows go in date order, so the (user_id, date) index is filled at its end
+        offsets = sorted(rnd.random() * DAYS for _ in range(share))
+        categories = own_categories.get(user_id, [])
+        for offset in offsets:
+            if categories and rnd.random() < 0.1:
+                category_id, category_type = rnd.choice(categories)
+            elif rnd.random() < 0.15:
+                category_id, category_type = rnd.choice(INCOME_CATEGORIES), "income"
+            else:
+                category_id, category_type = rnd.choice(EXPENSE_CATEGORIES), "expense"
+            cents = rnd.randint(100, 50000) if category_type == "expense" else rnd.randint(50000, 400000)
+            date = (START_DATE + datetime.timedelta(days=offset)).strftime("%Y-%m-%d %H:%M:%S")
+            yield (user_id, category_id, -cents if category_type == "expense" else cents, rnd.choice(DESCRIPTIONS), date)
+
+
+def _groups(rnd, users, count, max_size):
+    groups, members, spending = [], [], []
+    for group_id in range(1, count + 1):
+        # mostly small groups, some large ones
+        size = min(users, 2 + int(rnd.paretovariate(1.5)) % (max_size - 1))
+        creator = rnd.randint(1, users)
+        others = rnd.sample([user_id for user_id in range(max(1, creator - 5 * max_size), min(users, creator + 5 * max_size) + 1)
+                             if user_id != creator], size - 1)
+        paid = {user_id: rnd.randint(0, 20000) for user_id in [creator] + others}
+        groups.append((group_id, f"group {group_id}", creator, sum(paid.values()), len(paid)))
+        for user_id, cents in paid.items():
+            members.append((group_id, user_id, cents))
+            spending.append((group_id, user_id, cents))
+    return groups, members, spending
+
+
+def generate(path, users=1000, transactions=200000, groups=500, max_group_size=20, categories_per_user=3, seed=42):
+    """ Create `path` from scratch and fill it. Returns a dict of how many rows went into each table. """
+    if users < max_group_size:
+        raise ValueError("Need at least as many users as the largest group.")
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+    rnd = random.Random(seed)
+    password_hash = bcrypt.hashpw(PASSWORD.encode("utf-8"), bcrypt.gensalt(rounds=BCRYPT_ROUNDS)).decode("utf-8")
+
+    db = Database(path)
+    migrate(db)
+    # a throwaway file: no journal and no fsync while loading
+    db.execute("PRAGMA journal_mode = OFF")
+    db.execute("PRAGMA synchronous = OFF")
+    counts = {}
+    with db.transaction():
+        counts["users"] = 0
+        for batch in _batches(_users(users, password_hash)):
+            db.executemany("INSERT INTO users (id, username, email, password) VALUES (?, ?, ?, ?)", batch)
+            counts["users"] += len(batch)
+
+        category_rows, own_categories = _categories(rnd, users, categories_per_user)
+        db.executemany("INSERT INTO categories (id, name, type, user_id) VALUES (?, ?, ?, ?)", category_rows)
+        counts["categories"] = len(category_rows)
+
+        counts["transactions"] = 0
+        for batch in _batches(_transactions(rnd, users, transactions, own_categories)):
+            db.executemany(
+                "INSERT INTO transactions (user_id, category_id, amount, description, date) VALUES (?, ?, ?, ?, ?)", batch
+            )
+            counts["transactions"] += len(batch)
+        # one pass at the end instead of an upsert per row like Transaction does
+        db.execute("DELETE FROM category_totals")
+        db.execute("""
+        INSERT INTO category_totals (user_id, category_id, month, total_amount, tx_count)
+        SELECT user_id, category_id, substr(date, 1, 7), SUM(amount), COUNT(*)
+        FROM transactions
+        GROUP BY user_id, category_id, substr(date, 1, 7)
+        """)
+
+        group_rows, member_rows, spending_rows = _groups(rnd, users, groups, max_group_size)
+        db.executemany(
+            "INSERT INTO groups (id, name, created_by, total_amount, member_count) VALUES (?, ?, ?, ?, ?)", group_rows
+        )
+        db.executemany("INSERT INTO group_members (group_id, user_id, amount_spent) VALUES (?, ?, ?)", member_rows)
+        db.executemany("INSERT INTO group_transactions (group_id, user_id, amount_spent) VALUES (?, ?, ?)", spending_rows)
+        counts["groups"] = len(group_rows)
+        counts["group_members"] = len(member_rows)
+    db.execute("ANALYZE")
+    db.close()
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("path")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--transactions", type=int, default=200000)
+    parser.add_argument("--groups", type=int, default=500)
+    parser.add_argument("--max-group-size", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    counts = generate(args.path, args.users, args.transactions, args.groups, args.max_group_size, seed=args.seed)
+    took = time.perf_counter() - started
+    print(", ".join(f"{count} {table}" for table, count in counts.items()) + f" in {took:.1f}s "
+          f"({counts['transactions'] / took:.0f} transactions/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,289 @@
+""" Mixed traffic against the whole app: throughput, latency percentiles, "database is locked" errors and 429s.
+
+Every virtual client logs in as one of the generated users and then keeps picking actions by weight.
+Clients are threads, --processes starts several processes like gunicorn workers, each with its own app
+and pools on the same database file, so sqlite's file locking is exercised the way it is in production.
+Run from the project root:
+    python -m benchmarks.load --seconds 20 --processes 2 --threads 8
+    python -m benchmarks.load --server --threads 16     # through a local threaded WSGI server instead of the test client
+"""
+import argparse
+import http.client
+import json
+import multiprocessing
+import os
+import random
+import tempfile
+import threading
+import time
+from benchmarks import datagen
+from benchmarks.bench_hot_paths import percentile
+
+# relative weights of the actions a client picks from
+MIX = {
+    "login": 5,
+    "add_transaction": 25,
+    "transactions": 35,
+    "chart_compare": 15,
+    "dutch_create": 5,
+    "dutch_get": 15,
+}
+
+
+def build_app(args):
+    from app import create_app
+
+    app = create_app({
+        "DATABASE": args.database,
+        "SWAGGER_ENABLED": False,
+        "RATELIMIT_ENABLED": not args.no_limits,
+        # one counter file for every process, like the real deployment
+        "RATELIMIT_STORAGE_URI": "sqlite:///" + args.limiter_db,
+        "DB_POOL_SIZE": args.pool_size,
+    })
+    if args.server:
+        from werkzeug.middleware.proxy_fix import ProxyFix
+
+        # the HTTP clients all connect from 127.0.0.1 and send their own address in X-Forwarded-For,
+        # as a reverse proxy would, so they don't share one login limit
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1)
+    return app
+
+
+class TestClientTarget:
+    def __init__(self, app, address):
+        self.client = app.test_client()
+        # every virtual client gets its own address, or they would all share 127.0.0.1's login limits
+        self.environ = {"REMOTE_ADDR": address}
+
+    def request(self, method, path, body=None, token=None):
+        headers = {"Authorization": f"Bearer {token}"} if token else {}
+        response = self.client.open(path, method=method, json=body, headers=headers, environ_base=self.environ)
+        return response.status_code, response.get_data(as_text=True)
+
+
+class HttpTarget:
+    def __init__(self, host, port, address):
+        self.host = host
+        self.port = port
+        self.address = address
+
+    def request(self, method, path, body=None, token=None):
+        headers = {"Content-Type": "application/json", "X-Forwarded-For": self.address}
+        if token:
+            headers["Authorization"] = f"Bearer {token}"
+        # the dev server closes the connection after every response, so there is nothing to keep alive
+        connection = http.client.HTTPConnection(self.host, self.port, timeout=60)
+        try:
+            connection.request(method, path, body=json.dumps(body) if body is not None else None, headers=headers)
+            response = connection.getresponse()
+            return response.status, response.read().decode("utf-8", "replace")
+        finally:
+            connection.close()
+
+
+class Client:
+    """ One virtual user. Records (action, seconds, status, body) for every request it makes. """
+
+    def __init__(self, target, user_index, users, rnd, record):
+        self.target = target
+        self.user_index = user_index
+        self.username = datagen.username(user_index)
+        self.users = users
+        self.rnd = rnd
+        self.record = record
+        self.token = None
+        self.groups = []
+        self.created = 0
+
+    def call(self, action, method, path, body=None):
+        started = time.perf_counter()
+        try:
+            status, text = self.target.request(method, path, body, self.token)
+        except Exception as e:
+            status, text = 0, repr(e)
+        self.record(action, time.perf_counter() - started, status, text)
+        return status, text
+
+    def login(self):
+        status, text = self.call("login", "POST", "/auth/login", {"identifier": self.username, "password": datagen.PASSWORD})
+        if status == 200:
+            self.token = json.loads(text)["token"]
+        elif status in (429, 503):
+            # like a real user, wait instead of retrying in a tight loop
+            time.sleep(1)
+
+    def add_transaction(self):
+        expense = self.rnd.random() < 0.85
+        self.call("add_transaction", "POST", "/dashboard/add_transaction", {
+            "category_id": self.rnd.choice(datagen.EXPENSE_CATEGORIES if expense else datagen.INCOME_CATEGORIES),
+            "amount": round(self.rnd.uniform(1, 500), 2),
+            "description": "load test",
+        })
+
+    def transactions(self):
+        query = "?limit=50&from=2024-01-01" if self.rnd.random() < 0.3 else ""
+        self.call("transactions", "GET", f"/dashboard/transactions{query}")
+
+    def chart_compare(self):
+        self.call("chart_compare", "GET", "/dashboard/chart/compare")
+
+    def dutch_create(self):
+        others = [datagen.username(index) for index in
+                  self.rnd.sample([i for i in range(1, self.users + 1) if i != self.user_index], self.rnd.randint(1, 4))]
+        spent = {username: self.rnd.randint(0, 10000) / 100 for username in others + [self.username]}
+        self.created += 1
+        status, text = self.call("dutch_create", "POST", "/dutch", {
+            "name": f"load {os.getpid()} {threading.get_ident()} {self.created}",
+            "total_amount": round(sum(spent.values()), 2),
+            "members": others,
+            "spent": spent,
+        })
+        if status == 201:
+            self.groups.append(json.loads(text)["group_id"])
+
+    def dutch_get(self):
+        if self.groups:
+            self.call("dutch_get", "GET", f"/dutch/{self.rnd.choice(self.groups)}")
+        else:
+            self.call("dutch_get", "GET", "/dutch")
+
+    def step(self):
+        if self.token is None:
+            return self.login()
+        action = self.rnd.choices(list(MIX), weights=list(MIX.values()))[0]
+        getattr(self, action)()
+
+
+def run_clients(make_target, args, worker_index):
+    """ args.threads clients in this process until args.seconds are up, returns {action: stats}. """
+    lock = threading.Lock()
+    samples = {}
+
+    def record(action, seconds, status, text):
+        with lock:
+            entry = samples.setdefault(action, {"latencies": [], "statuses": {}, "locked": 0, "examples": {}})
+            entry["latencies"].append(seconds)
+            entry["statuses"][status] = entry["statuses"].get(status, 0) + 1
+            if "database is locked" in text:
+                entry["locked"] += 1
+            if not 200 <= status < 300 and status != 429:
+                # the first body of every failure kind, so the report can say what went wrong
+                entry["examples"].setdefault(status, text[:200])
+
+    stop = time.perf_counter() + args.seconds
+
+    def client(thread_index):
+        seed = worker_index * 1000 + thread_index
+        rnd = random.Random(seed)
+        user_index = 1 + seed % args.users
+        address = f"10.{worker_index}.{thread_index // 256}.{thread_index % 256}"
+        virtual = Client(make_target(address), user_index, args.users, rnd, record)
+        while time.perf_counter() < stop:
+            virtual.step()
+            if args.think_ms:
+                time.sleep(rnd.expovariate(1000 / args.think_ms))
+
+    threads = [threading.Thread(target=client, args=(index,)) for index in range(args.threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples
+
+
+def process_worker(args, worker_index, results):
+    app = build_app(args)
+    results.put(run_clients(lambda address: TestClientTarget(app, address), args, worker_index))
+
+
+def merge(results):
+    merged = {}
+    for samples in results:
+        for action, entry in samples.items():
+            total = merged.setdefault(action, {"latencies": [], "statuses": {}, "locked": 0, "examples": {}})
+            total["latencies"].extend(entry["latencies"])
+            total["locked"] += entry["locked"]
+            for status, text in entry["examples"].items():
+                total["examples"].setdefault(status, text)
+            for status, count in entry["statuses"].items():
+                total["statuses"][status] = total["statuses"].get(status, 0) + count
+    return merged
+
+
+def report(merged, seconds):
+    print(f"{'action':<18}{'requests':>10}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+          f"{'2xx':>8}{'4xx':>7}{'429':>7}{'5xx':>7}{'locked':>8}")
+    everything = {"latencies": [], "statuses": {}, "locked": 0}
+    for action in list(MIX) + [""]:
+        entry = merged.get(action) if action else everything
+        if entry is None:
+            continue
+        if action:
+            everything["latencies"].extend(entry["latencies"])
+            everything["locked"] += entry["locked"]
+            for status, count in entry["statuses"].items():
+                everything["statuses"][status] = everything["statuses"].get(status, 0) + count
+        statuses = entry["statuses"]
+        by_class = lambda low, high: sum(count for status, count in statuses.items() if low <= status < high)
+        latencies = entry["latencies"]
+        # the server's own failures and connection errors (status 0) both count as 5xx
+        print(f"{action or 'total':<18}{len(latencies):>10}{len(latencies) / seconds:>9.1f}"
+              f"{percentile(latencies, 0.5) * 1000:>9.1f}{percentile(latencies, 0.95) * 1000:>9.1f}"
+              f"{percentile(latencies, 0.99) * 1000:>9.1f}{by_class(200, 300):>8}"
+              f"{by_class(400, 500) - statuses.get(429, 0):>7}{statuses.get(429, 0):>7}"
+              f"{by_class(500, 600) + statuses.get(0, 0):>7}{entry['locked']:>8}")
+
+    for action, entry in merged.items():
+        for status, text in sorted(entry["examples"].items()):
+            print(f"  {action} {status}: {text.strip()}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database", help="database made by benchmarks.datagen. It gets written to, when "
+                        "restoring a copy also delete its -wal and -shm files or sqlite reads a corrupt mix")
+    parser.add_argument("--users", type=int, default=200, help="users to generate, or the number in --database")
+    parser.add_argument("--transactions", type=int, default=50000)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--processes", type=int, default=1)
+    parser.add_argument("--threads", type=int, default=8, help="clients per process")
+    parser.add_argument("--think-ms", type=float, default=0, help="mean pause between a client's requests")
+    parser.add_argument("--pool-size", type=int, default=5, help="DB_POOL_SIZE of every app")
+    parser.add_argument("--server", action="store_true", help="drive a local threaded WSGI server over HTTP")
+    parser.add_argument("--no-limits", action="store_true", help="turn the rate limiter off")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.database is None:
+            args.database = os.path.join(tmp, "load.db")
+            datagen.generate(args.database, users=args.users, transactions=args.transactions, groups=args.users // 2)
+        args.limiter_db = os.path.join(tmp, "limiter.db")
+
+        if args.server:
+            from werkzeug.serving import make_server
+
+            server = make_server("127.0.0.1", 0, build_app(args), threaded=True)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            results = [run_clients(lambda address: HttpTarget("127.0.0.1", server.server_port, address), args, 0)]
+            server.shutdown()
+        elif args.processes == 1:
+            app = build_app(args)
+            results = [run_clients(lambda address: TestClientTarget(app, address), args, 0)]
+        else:
+            queue = multiprocessing.Queue()
+            workers = [multiprocessing.Process(target=process_worker, args=(args, index, queue))
+                       for index in range(args.processes)]
+            for worker in workers:
+                worker.start()
+            results = [queue.get() for _ in workers]
+            for worker in workers:
+                worker.join()
+
+    mode = "http" if args.server else f"{args.processes} process(es)"
+    print(f"{mode} x {args.threads} clients for {args.seconds:.0f}s")
+    report(merge(results), args.seconds)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,15 @@
+import json
+import sys
+from app import create_app
+
+# python build_apispec.py [output file]
+#   renders the Swagger spec from the route docstrings once, so workers load it instead of building it
+path = sys.argv[1] if len(sys.argv) > 1 else "apispec.json"
+app = create_app({"SWAGGER_SPEC_FILE": None})
+
+with app.app_context():
+    specs = {endpoint: app.swag.get_apispecs(endpoint) for endpoint in app.swag.endpoints}
+
+with open(path, "w") as f:
+    json.dump(specs, f)
+print(f"Wrote {', '.join(specs)} to {path}.")
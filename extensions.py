@@ -1,8 +1,44 @@
+from flask import current_app, g, request
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
+import middleware.limiter_storage  # registers the "sqlite://" storage scheme
+from middleware.auth import token_user_id
+
+# Per blueprint budgets, override any of them with app.config["RATELIMIT_QUOTAS"].
+# They replace the global defaults for that blueprint and count per user once a request carries a token.
+DEFAULT_QUOTAS = {
+    "auth": "200 per day;50 per hour",
+    "dashboard": "2000 per day;500 per hour",
+    "dutch": "1000 per day;200 per hour",
+}
+
+# How much of the quota one request uses, by path. Override with app.config["RATELIMIT_COSTS"].
+DEFAULT_COSTS = {
+    # reads the platform-wide totals of every category
+    "/dashboard/chart/compare": 5,
+    "/dashboard/transactions/export": 10,
+    "/dashboard/transactions/import": 10,
+}
+
+def rate_limit_key():
+    # limits run before token_required, so the token is read here too (from the token cache when possible)
+    current_user = g.get("current_user")
+    user_id = current_user["id"] if current_user else token_user_id(request.headers.get("Authorization"))
+    if user_id is not None:
+        return f"user:{user_id}"
+    return f"ip:{get_remote_address()}"
+
+def quota(blueprint):
+    def limit_value():
+        return current_app.config.get("RATELIMIT_QUOTAS", {}).get(blueprint, DEFAULT_QUOTAS[blueprint])
+    return limit_value
+
+def request_cost():
+    costs = current_app.config.get("RATELIMIT_COSTS", DEFAULT_COSTS)
+    return costs.get(request.path, 1)
 
 limiter = Limiter(
-    key_func=get_remote_address,
+    key_func=rate_limit_key,
     default_limits=["200 per day", "50 per hour"]
 )
 #here we defined the limiter and the initialize it in our app file then use in in route file
@@ -0,0 +1,278 @@
+""" Request, database, limiter and cache metrics served on /metrics in the Prometheus text format.
+
+Every worker process keeps its own numbers in memory. With METRICS_DIR set, each one also writes them to
+METRICS_DIR/<pid>.json (at most once per METRICS_FLUSH_INTERVAL seconds) and /metrics adds up the files
+of all workers, so it does not matter which worker answers the scrape. Without it only the answering
+process is reported. Empty the directory when the service is restarted.
+"""
+import json
+import os
+import threading
+import time
+from flask import Response, current_app, g, request
+from extensions import limiter
+
+# seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+HELP = {
+    "http_request_duration_seconds": ("histogram", "Time from the first before_request hook to the response."),
+    "db_request_seconds": ("histogram", "Time a request spent running sql statements."),
+    "db_statements_total": ("counter", "Sql statements run by requests."),
+    "ratelimit_rejections_total": ("counter", "Requests answered with 429 by the rate limiter."),
+    "db_pool_connections": ("gauge", "Pooled sqlite connections by state."),
+    "db_pool_checkouts_total": ("counter", "Connections handed out by the pool."),
+    "db_pool_waits_total": ("counter", "Checkouts that had to wait for a free connection."),
+    "password_hash_queue": ("gauge", "Password hashes waiting or running on the hashing pool."),
+    "password_hash_rejected_total": ("counter", "Password hashes refused because the hashing queue was full."),
+    "cache_entries": ("gauge", "Entries in an in-process cache."),
+    "cache_hits_total": ("counter", "Cache lookups that found a live entry."),
+    "cache_misses_total": ("counter", "Cache lookups that found nothing or an expired entry."),
+    "cache_evictions_total": ("counter", "Entries dropped to stay under the cache size."),
+}
+
+
+class Registry:
+    """ Counters and histograms of this process, plus collectors that report live values when asked. """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._collectors = {}
+
+    def inc(self, name, labels, amount=1):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, labels, value):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            entry = self._histograms.get(key)
+            if entry is None:
+                # one slot per bucket plus +Inf, then sum
+                entry = self._histograms[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[index] += 1
+                    break
+            else:
+                entry[len(self.buckets)] += 1
+            entry[-1] += value
+
+    def add_collector(self, name, collector):
+        # collector() -> [(type, name, labels, value)], type "counter" or "gauge". A second one with the same name replaces the first
+        self._collectors[name] = collector
+
+    def snapshot(self):
+        with self._lock:
+            counters = [[name, list(labels), value] for (name, labels), value in self._counters.items()]
+            histograms = [[name, list(labels), list(entry)] for (name, labels), entry in self._histograms.items()]
+        gauges = []
+        for collector in list(self._collectors.values()):
+            for kind, name, labels, value in collector():
+                target = counters if kind == "counter" else gauges
+                target.append([name, sorted(labels.items()), value])
+        return {"pid": os.getpid(), "buckets": list(self.buckets), "counters": counters,
+                "histograms": histograms, "gauges": gauges}
+
+
+registry = Registry()
+_last_flush = 0.0
+_flush_lock = threading.Lock()
+
+
+def _path(directory, pid):
+    return os.path.join(directory, f"{pid}.json")
+
+
+def flush(directory):
+    # write to a temp file and rename, a scrape never reads half a file
+    snapshot = registry.snapshot()
+    path = _path(directory, snapshot["pid"])
+    with open(path + ".tmp", "w") as f:
+        json.dump(snapshot, f)
+    os.replace(path + ".tmp", path)
+    return snapshot
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+
+def collect(directory=None):
+    """ Snapshots of every worker. Counters of dead workers still count, their gauges don't. """
+    own = flush(directory) if directory else registry.snapshot()
+    if not directory:
+        return [own]
+    snapshots = [own]
+    for filename in os.listdir(directory):
+        if not filename.endswith(".json") or filename == f"{own['pid']}.json":
+            continue
+        try:
+            with open(os.path.join(directory, filename)) as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if not _alive(snapshot["pid"]):
+            snapshot["gauges"] = []
+        snapshots.append(snapshot)
+    return snapshots
+
+
+def _labels(labels, extra=None):
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + "}"
+
+
+def render(snapshots):
+    counters = {}
+    gauges = {}
+    histograms = {}
+    buckets = snapshots[0]["buckets"]
+    for snapshot in snapshots:
+        for name, labels, value in snapshot["counters"]:
+            key = (name, tuple(map(tuple, labels)))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, value in snapshot["gauges"]:
+            key = (name, tuple(map(tuple, labels)))
+            gauges[key] = gauges.get(key, 0) + value
+        if snapshot["buckets"] != buckets:
+            continue
+        for name, labels, entry in snapshot["histograms"]:
+            key = (name, tuple(map(tuple, labels)))
+            total = histograms.setdefault(key, [0] * len(entry))
+            for index, value in enumerate(entry):
+                total[index] += value
+
+    by_name = {}
+    for (name, labels), value in list(counters.items()) + list(gauges.items()):
+        by_name.setdefault(name, []).append(f"{name}{_labels(labels)} {value}")
+    for (name, labels), entry in histograms.items():
+        lines = by_name.setdefault(name, [])
+        cumulative = 0
+        for bound, count in zip(list(buckets) + ["+Inf"], entry[:-1]):
+            cumulative += count
+            lines.append(f"{name}_bucket{_labels(labels, ('le', bound))} {cumulative}")
+        lines.append(f"{name}_sum{_labels(labels)} {entry[-1]}")
+        lines.append(f"{name}_count{_labels(labels)} {cumulative}")
+
+    output = []
+    for name in sorted(by_name):
+        kind, text = HELP.get(name, ("untyped", name))
+        output.append(f"# HELP {name} {text}")
+        output.append(f"# TYPE {name} {kind}")
+        output.extend(by_name[name])
+    return "\n".join(output) + "\n"
+
+
+def _route_labels(status=None):
+    labels = {
+        "blueprint": request.blueprint or "",
+        # the rule, not the path, so /dutch/1 and /dutch/2 are one series
+        "route": request.url_rule.rule if request.url_rule else "unmatched",
+        "method": request.method,
+    }
+    if status is not None:
+        labels["status"] = str(status)
+    return labels
+
+
+def _start_timer():
+    g.metrics_started = time.perf_counter()
+
+
+def _record_request(response):
+    global _last_flush
+    started = g.get("metrics_started")
+    if started is not None:
+        registry.observe("http_request_duration_seconds", _route_labels(response.status_code), time.perf_counter() - started)
+
+    db = g.get("db")
+    if db is not None and db.statement_count:
+        labels = _route_labels()
+        registry.inc("db_statements_total", labels, db.statement_count)
+        # without timing query_time stays 0, which would read as free queries
+        if db.timed:
+            registry.observe("db_request_seconds", labels, db.query_time)
+
+    directory = current_app.config["METRICS_DIR"]
+    if directory and time.monotonic() - _last_flush >= current_app.config["METRICS_FLUSH_INTERVAL"]:
+        with _flush_lock:
+            _last_flush = time.monotonic()
+            flush(directory)
+    return response
+
+
+def record_rate_limited():
+    registry.inc("ratelimit_rejections_total", _route_labels())
+
+
+def _pool_collector(app):
+    def collect_pools():
+        values = []
+        for name, key in (("write", "db_pool"), ("read", "db_read_pool")):
+            pool = app.extensions.get(key)
+            if pool is None:
+                continue
+            stats = pool.stats()
+            for state in ("in_use", "idle"):
+                values.append(("gauge", "db_pool_connections", {"pool": name, "state": state}, stats[state]))
+            values.append(("counter", "db_pool_checkouts_total", {"pool": name}, stats["checkouts"]))
+            values.append(("counter", "db_pool_waits_total", {"pool": name}, stats["waits"]))
+
+        hasher = app.extensions.get("password_hasher")
+        if hasher is not None:
+            stats = hasher.stats()
+            values.append(("gauge", "password_hash_queue", {"state": "queued"}, stats["queued"]))
+            values.append(("gauge", "password_hash_queue", {"state": "running"}, stats["running"]))
+            values.append(("counter", "password_hash_rejected_total", {}, stats["rejected"]))
+        return values
+    return collect_pools
+
+
+def _collect_caches():
+    from middleware.auth import verified_tokens
+    from models.chart import category_benchmarks
+
+    values = []
+    for name, cache in (("verified_tokens", verified_tokens), ("category_benchmarks", category_benchmarks)):
+        stats = cache.stats()
+        labels = {"cache": name}
+        values.append(("gauge", "cache_entries", labels, stats["size"]))
+        values.append(("counter", "cache_hits_total", labels, stats["hits"]))
+        values.append(("counter", "cache_misses_total", labels, stats["misses"]))
+        values.append(("counter", "cache_evictions_total", labels, stats["evictions"]))
+    return values
+
+
+def metrics_view():
+    snapshots = collect(current_app.config["METRICS_DIR"])
+    return Response(render(snapshots), mimetype="text/plain; version=0.0.4")
+
+
+def init_app(app):
+    """ Call before limiter.init_app so requests rejected by the limiter are timed too. """
+    app.config.setdefault("METRICS_DIR", os.environ.get("METRICS_DIR") or None)
+    app.config.setdefault("METRICS_FLUSH_INTERVAL", 1.0)
+    # db_request_seconds needs the statements timed, pass DB_TIME_STATEMENTS=False to skip that cost
+    app.config.setdefault("DB_TIME_STATEMENTS", True)
+    if app.config["METRICS_DIR"]:
+        os.makedirs(app.config["METRICS_DIR"], exist_ok=True)
+
+    app.before_request(_start_timer)
+    app.after_request(_record_request)
+    registry.add_collector("pools", _pool_collector(app))
+    registry.add_collector("caches", _collect_caches)
+    app.add_url_rule("/metrics", "metrics", limiter.exempt(metrics_view))
@@ -1,12 +1,18 @@
 import jwt
-from flask import request, jsonify
+import time
+from flask import request, jsonify, g
 from functools import wraps
-from models.auth import Users
-from models.db import Database
+from models.db import get_db
 from models.auth import SECRET_KEY
+from models.cache import TTLCache, subscribe
 
-db = Database('file.db')
-user = Users()
+# token -> user payload, kept until the token expires (at most 15 minutes, the access token lifetime)
+verified_tokens = TTLCache(maxsize=10000, ttl=15 * 60)
+
+def invalidate_user(user_id, **_):
+    verified_tokens.invalidate_where(lambda token, user_data: user_data["id"] == user_id)
+
+subscribe("user_deleted", invalidate_user)
 
 def token_required(f):
     @wraps(f)
@@ -19,6 +25,7 @@ def token_required(f):
         if error:
             return jsonify({"error": error}), 401
 
+        g.current_user = user_data
         return f(user_data, *args, **kwargs)
 
     return decorated
@@ -29,9 +36,14 @@ def verify_token(token):
         if token.startswith("Bearer "):
             token = token.split("Bearer ")[1]
 
+        # a token seen before skips both the signature check and the user lookup
+        cached = verified_tokens.get(token)
+        if cached is not None:
+            return dict(cached), None
+
         payload = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
         
-        db = Database("file.db")
+        db = get_db()
 
         user = db.fetch_one("SELECT id, username, email FROM users WHERE id = ?", (payload["user_id"],))
 
@@ -44,10 +56,29 @@ def verify_token(token):
             "email": user["email"]
         }
 
-        return user_data, None 
+        remaining = payload["exp"] - time.time()
+        if remaining > 0:
+            verified_tokens.set(token, user_data, ttl=min(remaining, verified_tokens.ttl))
+
+        return dict(user_data), None 
 
     except jwt.ExpiredSignatureError:
         return None, "Token expired"
       
     except jwt.InvalidTokenError:
-        return None, "Invalid token" 
+        return None, "Invalid token"
+
+def token_user_id(token):
+    """ User id of a valid token or None. Signature only, no database lookup. """
+    if not token:
+        return None
+    if token.startswith("Bearer "):
+        token = token.split("Bearer ")[1]
+
+    cached = verified_tokens.get(token)
+    if cached is not None:
+        return cached["id"]
+    try:
+        return jwt.decode(token, SECRET_KEY, algorithms=["HS256"]).get("user_id")
+    except jwt.InvalidTokenError:
+        return None
@@ -0,0 +1,150 @@
+""" Rate limit counters in a local sqlite file, shared by every worker process on the host.
+
+Registered with the limits library under the "sqlite" scheme, so Flask-Limiter picks it up from
+RATELIMIT_STORAGE_URI = "sqlite:///limiter.db" (relative path) or "sqlite:////var/run/app/limiter.db" (absolute).
+"""
+import os
+import sqlite3
+import threading
+import time
+from urllib.parse import urlparse
+from limits.storage import Storage, SlidingWindowCounterSupport
+from limits.storage.base import TimestampedSlidingWindow
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS limiter_counters(
+    key TEXT PRIMARY KEY,
+    count INTEGER NOT NULL,
+    expires_at REAL NOT NULL  -- unix time
+) WITHOUT ROWID
+"""
+
+# one statement per hit: start a new window if the old one ran out, otherwise add to it
+INCR = """
+INSERT INTO limiter_counters (key, count, expires_at) VALUES (:key, :amount, :expires_at)
+ON CONFLICT(key) DO UPDATE SET
+    count = CASE WHEN expires_at <= :now THEN :amount ELSE count + :amount END,
+    expires_at = CASE WHEN expires_at <= :now THEN :expires_at ELSE expires_at END
+RETURNING count
+"""
+
+# expired rows are only dropped every this many increments
+PURGE_EVERY = 1000
+
+
+class SQLiteStorage(Storage, SlidingWindowCounterSupport, TimestampedSlidingWindow):
+    STORAGE_SCHEME = ["sqlite"]
+
+    def __init__(self, uri=None, wrap_exceptions=False, busy_timeout=5000, **_):
+        parsed = urlparse(uri or "sqlite:///limiter.db")
+        # sqlite:///name.db is relative, sqlite:////abs/name.db absolute, like SQLAlchemy
+        self.path = parsed.path[1:] or "limiter.db"
+        self.busy_timeout = int(busy_timeout)
+        self._local = threading.local()
+        self._increments = 0
+        # nothing is opened here, the file and table are created by the first check
+        super().__init__(uri, wrap_exceptions=wrap_exceptions)
+
+    @property
+    def base_exceptions(self):
+        return sqlite3.Error
+
+    def _connection(self):
+        # one connection per thread, and a new one after a fork so workers never share a handle
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode = WAL")
+            # counters are cheap to lose on a power cut, not worth an fsync per request
+            conn.execute("PRAGMA synchronous = OFF")
+            conn.execute(f"PRAGMA busy_timeout = {self.busy_timeout}")
+            conn.execute(SCHEMA)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def incr(self, key, expiry, amount=1):
+        now = time.time()
+        conn = self._connection()
+        # fetchall so the RETURNING statement runs to completion and autocommits right away
+        count = conn.execute(INCR, {"key": key, "amount": amount, "expires_at": now + expiry, "now": now}).fetchall()[0][0]
+        self._increments += 1
+        if self._increments % PURGE_EVERY == 0:
+            conn.execute("DELETE FROM limiter_counters WHERE expires_at <= ?", (now,))
+        return count
+
+    def decr(self, key, amount=1):
+        rows = self._connection().execute(
+            "UPDATE limiter_counters SET count = max(count - ?, 0) WHERE key = ? AND expires_at > ? RETURNING count",
+            (amount, key, time.time()),
+        ).fetchall()
+        return rows[0][0] if rows else 0
+
+    def get(self, key):
+        row = self._connection().execute(
+            "SELECT count FROM limiter_counters WHERE key = ? AND expires_at > ?", (key, time.time())
+        ).fetchone()
+        return row[0] if row else 0
+
+    def get_expiry(self, key):
+        now = time.time()
+        row = self._connection().execute(
+            "SELECT expires_at FROM limiter_counters WHERE key = ? AND expires_at > ?", (key, now)
+        ).fetchone()
+        return row[0] if row else now
+
+    def check(self):
+        try:
+            self._connection().execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def reset(self):
+        return self._connection().execute("DELETE FROM limiter_counters").rowcount
+
+    def clear(self, key):
+        self._connection().execute("DELETE FROM limiter_counters WHERE key = ?", (key,))
+
+    def _sliding_window(self, conn, key, expiry, now):
+        previous_key, current_key = self.sliding_window_keys(key, expiry, now)
+        counts = dict(conn.execute(
+            "SELECT key, count FROM limiter_counters WHERE key IN (?, ?) AND expires_at > ?",
+            (previous_key, current_key, now),
+        ).fetchall())
+        previous_count = counts.get(previous_key, 0)
+        current_count = counts.get(current_key, 0)
+        previous_ttl = 0.0 if previous_count == 0 else (1 - (((now - expiry) / expiry) % 1)) * expiry
+        current_ttl = (1 - ((now / expiry) % 1)) * expiry + expiry
+        return current_key, previous_count, previous_ttl, current_count, current_ttl
+
+    def acquire_sliding_window_entry(self, key, limit, expiry, amount=1):
+        if amount > limit:
+            return False
+        now = time.time()
+        conn = self._connection()
+        # the check and the increment hold the write lock together, so no other worker can slip in between
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            current_key, previous_count, previous_ttl, current_count, _ = self._sliding_window(conn, key, expiry, now)
+            weighted = previous_count * previous_ttl / expiry + current_count
+            if int(weighted) + amount > limit:
+                conn.execute("COMMIT")
+                return False
+            # the current window is still read as the previous one for a whole window after it ends
+            conn.execute(INCR, {"key": current_key, "amount": amount, "expires_at": now + 2 * expiry, "now": now}).fetchall()
+            conn.execute("COMMIT")
+            return True
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def get_sliding_window(self, key, expiry):
+        _, previous_count, previous_ttl, current_count, current_ttl = self._sliding_window(
+            self._connection(), key, expiry, time.time()
+        )
+        return previous_count, previous_ttl, current_count, current_ttl
+
+    def clear_sliding_window(self, key, expiry):
+        previous_key, current_key = self.sliding_window_keys(key, expiry, time.time())
+        self._connection().execute("DELETE FROM limiter_counters WHERE key IN (?, ?)", (previous_key, current_key))
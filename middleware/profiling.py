@@ -0,0 +1,193 @@
+""" Opt-in profiling of single requests, written to PROFILE_DIR as collapsed stacks and/or cProfile dumps.
+
+Off unless PROFILE_DIR is set. A request is profiled when it sends the PROFILE_HEADER header (carrying
+PROFILE_SECRET if one is configured) or is picked by PROFILE_SAMPLE_RATE (0.0 - 1.0).
+
+    sample    a thread reads the request thread's stack every PROFILE_INTERVAL seconds and writes
+              <id>.collapsed, one "outer;inner;leaf count" line per stack, the input of flamegraph.pl and speedscope
+    cprofile  every call is traced and written to <id>.prof, open it with pstats or snakeviz
+    both      both of the above
+
+Every profile gets a line in PROFILE_DIR/profiles.jsonl with its route, method, status, user and duration,
+and the response carries its id in X-Profile-Id. Only the view function is profiled, a streamed body
+(the transaction export) is produced after the profile has been written.
+"""
+import cProfile
+import json
+import os
+import random
+import sys
+import threading
+import time
+from functools import lru_cache, wraps
+from flask import current_app, g, request, make_response
+
+MODES = ("sample", "cprofile", "both")
+
+# the views of routes/routes.py
+BLUEPRINTS = ("auth", "dashboard", "dutch")
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class StackSampler:
+    """ Counts the stacks one thread is in, read from another thread every `interval` seconds. """
+
+    def __init__(self, thread_id, interval=0.001, stop_code=None):
+        self.thread_id = thread_id
+        self.interval = interval
+        # frames above this one (the server and flask) are the same in every sample and left out
+        self.stop_code = stop_code
+        self.stacks = {}
+        self.samples = 0
+        self._done = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._done.set()
+        self._thread.join()
+        return self.stacks
+
+    def _run(self):
+        while not self._done.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            names = []
+            while frame is not None and frame.f_code is not self.stop_code:
+                names.append(_frame_name(frame))
+                frame = frame.f_back
+            key = ";".join(reversed(names))
+            self.stacks[key] = self.stacks.get(key, 0) + 1
+            self.samples += 1
+
+    def collapsed(self):
+        return "".join(f"{stack} {count}\n" for stack, count in sorted(self.stacks.items()))
+
+
+@lru_cache(maxsize=4096)
+def _short_path(filename):
+    # project files relative to the project, libraries from their package on
+    prefixes = [prefix for prefix in (PROJECT_ROOT, *sys.path) if prefix and filename.startswith(prefix + os.sep)]
+    if not prefixes:
+        return filename
+    return filename[len(max(prefixes, key=len)) + 1:]
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    # ";" separates frames, the count after the last space is all that matters to the tools
+    return f"{code.co_name} ({_short_path(code.co_filename)}:{code.co_firstlineno})".replace(";", ":")
+
+
+def _wanted():
+    config = current_app.config
+    header = request.headers.get(config["PROFILE_HEADER"])
+    if header is not None:
+        secret = config["PROFILE_SECRET"]
+        return secret is None or header == secret
+    rate = config["PROFILE_SAMPLE_RATE"]
+    return rate > 0 and random.random() < rate
+
+
+def _profile_id(duration):
+    user = g.get("current_user")
+    user_part = f"u{user['id']}" if user else "anon"
+    route = (request.endpoint or "unmatched").replace(".", "-")
+    return f"{time.strftime('%Y%m%d-%H%M%S')}-{route}-{user_part}-{duration * 1000:.0f}ms-{os.getpid()}-{threading.get_ident() % 10000}"
+
+
+def _write(directory, profile_id, sampler, profiler, duration, response):
+    files = []
+    if sampler is not None:
+        path = os.path.join(directory, profile_id + ".collapsed")
+        with open(path, "w") as f:
+            f.write(sampler.collapsed())
+        files.append(os.path.basename(path))
+    if profiler is not None:
+        path = os.path.join(directory, profile_id + ".prof")
+        profiler.dump_stats(path)
+        files.append(os.path.basename(path))
+
+    user = g.get("current_user")
+    entry = {
+        "id": profile_id,
+        "files": files,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "method": request.method,
+        "route": request.url_rule.rule if request.url_rule else None,
+        "path": request.path,
+        "status": response.status_code,
+        "user_id": user["id"] if user else None,
+        "username": user["username"] if user else None,
+        "duration_ms": round(duration * 1000, 2),
+        "samples": sampler.samples if sampler is not None else None,
+    }
+    # one short write per line in append mode, lines of concurrent workers don't interleave
+    with open(os.path.join(directory, "profiles.jsonl"), "a") as f:
+        f.write(json.dumps(entry) + "\n")
+
+
+def profiled(view):
+    """ Wrap a view so it is profiled when the request asks for it or is sampled. """
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not _wanted():
+            return view(*args, **kwargs)
+
+        config = current_app.config
+        mode = config["PROFILE_MODE"]
+        sampler = profiler = None
+        if mode in ("sample", "both"):
+            sampler = StackSampler(threading.get_ident(), config["PROFILE_INTERVAL"], wrapper.__code__)
+            sampler.start()
+        if mode in ("cprofile", "both"):
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:
+                # another profiler is already running on this thread
+                profiler = None
+
+        started = time.perf_counter()
+        try:
+            response = make_response(view(*args, **kwargs))
+        finally:
+            duration = time.perf_counter() - started
+            if profiler is not None:
+                profiler.disable()
+            if sampler is not None:
+                sampler.stop()
+
+        # after the view so token_required has set g.current_user
+        profile_id = _profile_id(duration)
+        _write(config["PROFILE_DIR"], profile_id, sampler, profiler, duration, response)
+        response.headers["X-Profile-Id"] = profile_id
+        return response
+
+    return wrapper
+
+
+def init_app(app):
+    """ Call after the blueprints are registered, it wraps their views. """
+    app.config.setdefault("PROFILE_DIR", os.environ.get("PROFILE_DIR") or None)
+    app.config.setdefault("PROFILE_SAMPLE_RATE", float(os.environ.get("PROFILE_SAMPLE_RATE", 0)))
+    app.config.setdefault("PROFILE_HEADER", "X-Profile")
+    # without a secret any client can ask for a profile, set one anywhere but on a developer machine
+    app.config.setdefault("PROFILE_SECRET", os.environ.get("PROFILE_SECRET") or None)
+    app.config.setdefault("PROFILE_MODE", "sample")
+    app.config.setdefault("PROFILE_INTERVAL", 0.001)
+
+    if not app.config["PROFILE_DIR"]:
+        return
+    if app.config["PROFILE_MODE"] not in MODES:
+        raise ValueError(f"PROFILE_MODE must be one of: {', '.join(MODES)}.")
+    os.makedirs(app.config["PROFILE_DIR"], exist_ok=True)
+
+    for endpoint, view in list(app.view_functions.items()):
+        if endpoint.split(".")[0] in BLUEPRINTS:
+            app.view_functions[endpoint] = profiled(view)
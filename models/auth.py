@@ -1,7 +1,7 @@
-import bcrypt
 import jwt
 import datetime
-from models.db import Database
+from models.db import get_db
+from models.hashing import get_hasher
 import re
 import html
 
@@ -9,14 +9,13 @@ import html
 SECRET_KEY = "secret_key"
 
 class Users:
-    def __init__(self):
-        self.db = Database('file.db')
+    def __init__(self, db=None):
+        self.db = db if db is not None else get_db()
 
     @staticmethod
     def hash_password(password):
-        salt = bcrypt.gensalt()
-        hashed = bcrypt.hashpw(password.encode('utf-8'), salt)
-        return hashed
+        # bcrypt runs on the shared hashing pool, raises HashingBusy when it is full
+        return get_hasher().hash(password)
 
     @staticmethod
     def validate_inputs(username, email, password):
@@ -40,41 +39,55 @@ class Users:
     def create_user(self, username, email, password):
         self.validate_inputs(username, email, password)
 
-        if self.find_by_email_or_username(email) or self.find_by_email_or_username(username):
+        # neither value may match an existing username or e-mail, both probes in one query
+        query = """
+        SELECT id FROM users WHERE username IN (?, ?)
+        UNION ALL
+        SELECT id FROM users WHERE email_lower IN (lower(?), lower(?))
+        LIMIT 1
+        """
+        if self.db.fetch_one(query, (username, email, email, username)):
             raise ValueError("Username or e-mail already exists.")
         
         hashed_password = self.hash_password(password)
         query = "INSERT INTO users (username, email, password) VALUES (?, ?, ?)"
         
         try:
-            self.db.execute(query, (username, email, hashed_password))
-            return {"message": "User created successfully."}
+            cursor = self.db.execute(query, (username, email, hashed_password))
+            return {"message": "User created successfully.", "user_id": cursor.lastrowid}
         except Exception as e:
             return {"error": str(e)}
         
     def verify_user(self, identifier, password):
-        query = "SELECT password FROM users WHERE username = ? OR email = ?"
-        user = self.db.fetch_one(query, (identifier, identifier))
+        user = self.find_by_email_or_username(identifier)
         
         if user:
             stored_password_hash = user['password']
-            return bcrypt.checkpw(password.encode('utf-8'), stored_password_hash)
+            return get_hasher().verify(password, stored_password_hash)
         return False
 
     def login_user(self, identifier, password):
+        # one lookup, the same row is used for the password check
         user = self.find_by_email_or_username(identifier)
 
         if not user:
             raise ValueError("User not found.")
             
-        if not self.verify_user(identifier, password):
+        if not get_hasher().verify(password, user['password']):
             raise ValueError("Invalid username/email or password.")
        
         return {"message": "Login successful", "user_id": user['id']}
 
     def find_by_email_or_username(self, identifier):
+       # an OR over two columns can't use one index, two indexed probes can.
+       # A username match wins, the e-mail probe only runs when there is none.
        try:
-         query = "SELECT * FROM users WHERE username = ? OR email = ?"
+         query = """
+         SELECT * FROM users WHERE username = ?
+         UNION ALL
+         SELECT * FROM users WHERE email_lower = lower(?)
+         LIMIT 1
+         """
          user = self.db.fetch_one(query, (identifier, identifier))
          return user
        
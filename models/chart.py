@@ -1,60 +1,99 @@
-from models.db import Database
+from models.db import get_db
+from models.cache import TTLCache, subscribe
+from models.money import Money
+
+MAIN_CATEGORIES = (1, 2, 3, 4, 5, 6, 7)
+
+# Platform-wide totals per category. Writes in this process drop the entry right away,
+# writes from other workers are picked up when the TTL runs out.
+category_benchmarks = TTLCache(maxsize=32, ttl=60)
+
+def _invalidate_benchmarks(user_id=None, category_ids=None):
+    category_benchmarks.clear()
+
+subscribe("transactions_changed", _invalidate_benchmarks)
 
 class Chart:
-        def __init__(self, db_name):
-            self.db = Database(db_name)
+        def __init__(self, db=None):
+            self.db = db if db is not None else get_db()
 
         def get_users_categories(self, user_id):
         # 1. Fetch all categories the user has transactions in.
-        # 2. Sum the total amounts for each category.
+        # 2. Sum the total amounts for each category, in cents.
 
             query = """
-            SELECT category_id, SUM(amount) AS total_amount FROM
-            transactions WHERE
+            SELECT category_id, SUM(total_amount) AS total_amount FROM
+            category_totals WHERE
             user_id = ?
             GROUP BY category_id;
             """
             result = self.db.fetch_all(query, (user_id,))
 
-        # 3. Return data in a format suitable for charts.
+        # 3. Return {category_id: cents}, the format_* methods turn them into amounts.
             data = {category_id: total for category_id, total in result}
 
             return data
         
+        def get_platform_totals(self, categories=MAIN_CATEGORIES):
+            # {category_id: (total_cents, user_count)} over every user, and {category_id: {user_id: cents}}
+            # with what each user added to it, cached together as one snapshot
+            snapshot = category_benchmarks.get(categories)
+            if snapshot is not None:
+                return snapshot
+
+            placeholders = ", ".join("?" for _ in categories)
+            query = f"""
+            SELECT category_id, user_id, SUM(total_amount) AS total_amount
+            FROM category_totals
+            WHERE category_id IN ({placeholders})
+            GROUP BY category_id, user_id
+            """
+            shares = {}
+            for category_id, user_id, total in self.db.fetch_all(query, categories):
+                shares.setdefault(category_id, {})[user_id] = total
+            totals = {category_id: (sum(users.values()), len(users)) for category_id, users in shares.items()}
+            snapshot = (totals, shares)
+            category_benchmarks.set(categories, snapshot)
+            return snapshot
+
         def get_all_categories(self, user_id):
-            main_categories = [1, 2, 3, 4, 5, 6, 7]
+            main_categories = MAIN_CATEGORIES
             # 1. Fetch all categories.
             # 2. Sum total amounts spent/earned per category across all users.
+            # Both charts read the monthly aggregates kept up to date by Transaction, not the raw transactions.
+            # 3. Take the user's own share out of the cached platform totals instead of querying everyone else.
+            totals, shares = self.get_platform_totals(main_categories)
 
-            query = """
-            SELECT category_id, SUM(amount) AS total_amount, COUNT(DISTINCT user_id) AS user_count
-            FROM transactions
-            WHERE user_id != ? AND category_id IN (?, ?, ?, ?, ?, ?, ?)
-            GROUP BY category_id
-           
-            """
-            # The * operator unpacks the tuple (1, 2, 3, 4, 5, 6, 7), so it spreads the values into separate arguments.
-            results = self.db.fetch_all(query, (user_id, *main_categories))
-            
             data = []
             
-            for category_id, total, user_count in results:
-                average = total / user_count if user_count > 0 else 0
+            for category_id in main_categories:
+                if category_id not in totals:
+                    continue
+                total, user_count = totals[category_id]
+                # what the snapshot counted for this user, their live totals can be newer than it
+                counted = shares[category_id].get(user_id)
+                if counted is not None:
+                    total -= counted
+                    user_count -= 1
+                if user_count <= 0:
+                    continue
+
+                # the sums stay exact in cents, only the average is rounded
                 data.append({
                 "category_id": category_id,
-                "total_amount": total,
-                "average_amount": average
+                "total_amount": Money(total).amount,
+                "average_amount": round(total / user_count) / 100
                 })
             return data 
 
         def format_chart_data(self, user_id):    
-           comparison_data = self.get_all_categories(user_id)
            user_data = self.get_users_categories(user_id)
+           comparison_data = self.get_all_categories(user_id)
            chart_data = []
     
            for comparison in comparison_data:
             category_id = comparison["category_id"]
-            comparison["user_total"] = user_data.get(category_id, 0)  # get the user's total for this category, default to 0 if not found
+            comparison["user_total"] = Money(user_data.get(category_id, 0)).amount  # get the user's total for this category, default to 0 if not found
             chart_data.append(comparison)
     
            return chart_data
@@ -66,7 +105,7 @@ class Chart:
             for category_id, total in user_data.items():
                chart_data.append({
                   "category_id": category_id,
-                  "total_amount": total
+                  "total_amount": Money(total).amount
                 })
 
             return chart_data
@@ -1,45 +1,448 @@
+import logging
+import re
 import sqlite3
-from flask import g
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from functools import lru_cache
+from flask import g, current_app
+
+slow_query_log = logging.getLogger("models.db.slow")
+
+# Applied to every pooled connection. WAL lets readers run while a write is being committed.
+PRAGMA_PROFILE = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",  # safe with WAL, only the last commits can be lost on power failure
+    "cache_size": -16000,  # negative means KiB, ~16MB per connection
+    "mmap_size": 134217728,
+    "temp_store": "MEMORY",
+    "busy_timeout": 5000,  # ms to wait for the write lock instead of failing with "database is locked"
+}
+
+def apply_pragmas(connection, pragmas):
+    for name, value in (pragmas or {}).items():
+        connection.execute(f"PRAGMA {name} = {value}")
+
+@lru_cache(maxsize=1024)
+def normalize_sql(query):
+    # one line, literals replaced by ? and IN lists folded, so the same statement always looks the same
+    query = re.sub(r"'(?:[^']|'')*'", "?", query)
+    query = re.sub(r"\b\d+(?:\.\d+)?\b", "?", query)
+    query = re.sub(r"\(\s*\?(?:\s*,\s*\?)+\s*\)", "(...)", query)
+    return " ".join(query.split())
 
 class Database:
-    def __init__(self, db_name="file.db", check_same_thread=False):
-       self.connection = sqlite3.connect(db_name, check_same_thread=check_same_thread)
-       self.connection.row_factory = sqlite3.Row
+    def __init__(self, db_name="file.db", check_same_thread=False, pool=None, read_pool=None, pragmas=None,
+                 instrument=False, slow_query_ms=None, timed=False):
+       self.pool = pool
+       self.read_pool = read_pool
+       self._writer = None
+       self._reader = None
+       self._depth = 0
+       self.statement_count = 0
+       # instrument keeps (normalized sql, seconds, rows) for every statement in self.queries,
+       # slow_query_ms logs statements slower than that, timed only adds up query_time.
+       # Statements are only timed if one of them is on.
+       self.instrument = instrument
+       self.slow_query_ms = slow_query_ms
+       self._timed = timed or instrument or slow_query_ms is not None
+       self.queries = []
+       self.query_time = 0.0
+       if pool is None:
+           self._writer = sqlite3.connect(db_name, check_same_thread=check_same_thread, uri=db_name.startswith("file:"))
+           self._writer.row_factory = sqlite3.Row
+           apply_pragmas(self._writer, pragmas)
     #    self.cursor = self.connection.cursor()
 
+    @property
+    def connection(self):
+        # the write connection is only checked out once the request actually writes
+        if self._writer is None:
+            self._writer = self.pool.acquire()
+        return self._writer
+
+    @property
+    def timed(self):
+        # whether query_time is being added up, it stays 0 otherwise
+        return self._timed
+
+    @property
+    def read_connection(self):
+        # reads inside an open write transaction have to see its uncommitted rows
+        if self._writer is not None and self._writer.in_transaction:
+            return self._writer
+        if self.read_pool is None:
+            return self.connection
+        if self._reader is None:
+            self._reader = self.read_pool.acquire()
+        return self._reader
+
+    def _record(self, query, started, rows):
+        elapsed = time.perf_counter() - started
+        self.query_time += elapsed
+        if self.instrument:
+            self.queries.append((normalize_sql(query), elapsed, rows))
+        if self.slow_query_ms is not None and elapsed * 1000 >= self.slow_query_ms:
+            slow_query_log.warning("slow query %.1f ms, %s rows: %s", elapsed * 1000, rows, normalize_sql(query))
+
     def execute(self,query, params=()):
+        self.statement_count += 1
+        started = time.perf_counter() if self._timed else None
         try:
             cursor = self.connection.cursor()
             cursor.execute(query, params)
-            self.connection.commit()
+            if not self._depth:
+                self.connection.commit()
+            if started is not None:
+                self._record(query, started, cursor.rowcount)
             return cursor
         except sqlite3.Error as e:
-            self.connection.rollback()
-            raise 
-    
+            # inside transaction() the context manager decides what to roll back
+            if not self._depth:
+                self.connection.rollback()
+            raise
+
+    def executemany(self, query, seq_of_params):
+        self.statement_count += 1
+        started = time.perf_counter() if self._timed else None
+        try:
+            cursor = self.connection.cursor()
+            cursor.executemany(query, seq_of_params)
+            if not self._depth:
+                self.connection.commit()
+            if started is not None:
+                self._record(query, started, cursor.rowcount)
+            return cursor
+        except sqlite3.Error:
+            if not self._depth:
+                self.connection.rollback()
+            raise
+
+    @contextmanager
+    def transaction(self):
+        """ Run several writes as one unit: a single commit on success, nothing kept on error.
+
+        Nested blocks become savepoints, so a failing inner block only undoes its own writes.
+        """
+        connection = self.connection
+        savepoint = f"sp_{self._depth}"
+        if self._depth == 0:
+            # take the write lock up front so reads inside the block can't go stale
+            connection.execute("BEGIN IMMEDIATE")
+        else:
+            connection.execute(f"SAVEPOINT {savepoint}")
+        self._depth += 1
+        try:
+            yield self
+        except BaseException:
+            self._depth -= 1
+            if self._depth == 0:
+                connection.rollback()
+            else:
+                connection.execute(f"ROLLBACK TO {savepoint}")
+                connection.execute(f"RELEASE {savepoint}")
+            raise
+        else:
+            self._depth -= 1
+            if self._depth == 0:
+                connection.commit()
+            else:
+                connection.execute(f"RELEASE {savepoint}")
+
     def fetch_one(self, query, params):
-       cursor = self.connection.cursor()
+       self.statement_count += 1
+       started = time.perf_counter() if self._timed else None
+       cursor = self.read_connection.cursor()
        cursor.execute(query, params)
-       return cursor.fetchone()
+       row = cursor.fetchone()
+       if started is not None:
+           self._record(query, started, 0 if row is None else 1)
+       return row
 
     def fetch_all(self, query, params=()):
-        cursor = self.connection.cursor()
+        self.statement_count += 1
+        started = time.perf_counter() if self._timed else None
+        cursor = self.read_connection.cursor()
+        cursor.execute(query, params)
+        rows = cursor.fetchall()
+        if started is not None:
+            self._record(query, started, len(rows))
+        return rows
+
+    def iterate(self, query, params=(), size=500):
+        # streams rows in batches instead of building the whole result list
+        self.statement_count += 1
+        started = time.perf_counter() if self._timed else None
+        count = 0
+        cursor = self.read_connection.cursor()
         cursor.execute(query, params)
-        return cursor.fetchall()
+        try:
+            while True:
+                rows = cursor.fetchmany(size)
+                if not rows:
+                    break
+                count += len(rows)
+                yield from rows
+        finally:
+            cursor.close()
+            # includes the time the consumer spent between batches
+            if started is not None:
+                self._record(query, started, count)
+
+    def timing_summary(self, top=5):
+        """ Time and count per normalized statement, slowest first: [(sql, seconds, calls, rows)]. """
+        totals = {}
+        for sql, elapsed, rows in self.queries:
+            entry = totals.setdefault(sql, [0.0, 0, 0])
+            entry[0] += elapsed
+            entry[1] += 1
+            entry[2] += max(rows, 0)
+        ranked = sorted(totals.items(), key=lambda item: item[1][0], reverse=True)
+        return [(sql, seconds, calls, rows) for sql, (seconds, calls, rows) in ranked[:top]]
 
     def close(self):
-        self.connection.close()
-        
-# def get_db():
-#      if 'db' not in g:
-#         g.db = Database()
-#      return g.db
-
-# def close_connection(exception):
-#       db = g.pop('db', None)
-#       if db is not None:
-#         db.close()
-
-    
-        
-       
\ No newline at end of file
+        # pooled connections go back to their pool, safe to call more than once
+        if self._reader is not None:
+            self.read_pool.release(self._reader)
+            self._reader = None
+        if self._writer is not None:
+            if self.pool is not None:
+                self.pool.release(self._writer)
+            else:
+                self._writer.close()
+            self._writer = None
+
+
+@contextmanager
+def max_queries(db, limit):
+    """ Fail with AssertionError when the block runs more than `limit` statements on db.
+
+        with max_queries(dutch.db, 6):
+            dutch.calculation(user_id, group_id)
+    """
+    start = db.statement_count
+    yield
+    count = db.statement_count - start
+    if count > limit:
+        raise AssertionError(f"Expected at most {limit} queries, {count} were run.")
+
+
+class ConnectionPool:
+    """ Keeps open sqlite connections to one database file and hands them out per request. """
+
+    def __init__(self, db_name="file.db", size=5, timeout=30.0, pragmas=None, readonly=False):
+        self.db_name = db_name
+        self.size = size
+        self.timeout = timeout
+        self.pragmas = pragmas
+        self.readonly = readonly
+        self._idle = deque()
+        self._created = 0
+        self._in_use = 0
+        self._lock = threading.Condition()
+
+        # checkout metrics
+        self.checkouts = 0
+        self.waits = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def _connect(self):
+        connection = sqlite3.connect(self.db_name, check_same_thread=False, uri=self.db_name.startswith("file:"))
+        connection.row_factory = sqlite3.Row
+        apply_pragmas(connection, self.pragmas)
+        if self.readonly:
+            connection.execute("PRAGMA query_only = ON")
+        return connection
+
+    def acquire(self):
+        start = time.perf_counter()
+        waited = False
+        with self._lock:
+            while not self._idle and self._created >= self.size:
+                waited = True
+                remaining = self.timeout - (time.perf_counter() - start)
+                if remaining <= 0:
+                    raise TimeoutError(f"No free database connection after {self.timeout}s (pool size {self.size}).")
+                self._lock.wait(remaining)
+
+            if self._idle:
+                connection = self._idle.pop()
+            else:
+                # reserve the slot before connecting so other threads see it
+                self._created += 1
+                connection = None
+            self._in_use += 1
+
+        if connection is None:
+            try:
+                connection = self._connect()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                    self._in_use -= 1
+                    self._lock.notify()
+                raise
+
+        wait = time.perf_counter() - start
+        with self._lock:
+            self.checkouts += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+            if waited:
+                self.waits += 1
+        return connection
+
+    def release(self, connection):
+        # never hand a half-finished transaction to the next request
+        try:
+            if connection.in_transaction:
+                connection.rollback()
+        except sqlite3.Error:
+            connection.close()
+            connection = None
+
+        with self._lock:
+            self._in_use -= 1
+            if connection is None:
+                self._created -= 1
+            else:
+                self._idle.append(connection)
+            self._lock.notify()
+
+    def close_all(self):
+        with self._lock:
+            while self._idle:
+                self._idle.pop().close()
+                self._created -= 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": self.size,
+                "open": self._created,
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "checkouts": self.checkouts,
+                "waits": self.waits,
+                "avg_wait_ms": (self.total_wait / self.checkouts * 1000) if self.checkouts else 0.0,
+                "max_wait_ms": self.max_wait * 1000,
+            }
+
+
+def memory_uri(name):
+    # every connection to this uri in the process sees the same in-memory database. The memdb vfs is used
+    # instead of cache=shared because it locks like a file: writers wait for busy_timeout instead of
+    # failing right away with "database table is locked"
+    return f"file:/{name}?vfs=memdb"
+
+
+def init_app(app):
+    app.config.setdefault("DATABASE", "file.db")
+    # reads go here when set, e.g. a replica kept in sync outside the app
+    app.config.setdefault("DATABASE_READ", None)
+    app.config.setdefault("DB_POOL_SIZE", 5)
+    app.config.setdefault("DB_POOL_TIMEOUT", 30.0)
+    app.config.setdefault("DB_PRAGMAS", PRAGMA_PROFILE)
+    # per statement timing for the Server-Timing header, and the threshold of the slow query log (None: off)
+    app.config.setdefault("DB_INSTRUMENT", False)
+    app.config.setdefault("DB_SLOW_QUERY_MS", 200)
+    app.config.setdefault("DB_TIME_STATEMENTS", False)
+
+    database = app.config["DATABASE"]
+    in_memory = database == ":memory:" or database.startswith("memory://")
+    if in_memory:
+        # "memory://name" or ":memory:" for tests and benchmarks: a shared in-memory database that lives
+        # as long as the app, with its own name so parallel apps never touch each other's data
+        name = database[len("memory://"):] if database.startswith("memory://") else ""
+        database = memory_uri(name or f"app{id(app)}")
+        # the pools hand out and drop connections, this one keeps the database alive in between
+        app.extensions["db_keepalive"] = sqlite3.connect(database, uri=True, check_same_thread=False)
+        # no WAL in memory, readers and the writer would block each other anyway
+        app.config.setdefault("DB_READ_POOL_SIZE", 0)
+    app.config.setdefault("DB_READ_POOL_SIZE", 10)
+    # an empty in-memory database needs the schema, a file is migrated with init_db.py
+    app.config.setdefault("DB_MIGRATE", in_memory)
+
+    app.extensions["db_pool"] = ConnectionPool(
+        database,
+        size=app.config["DB_POOL_SIZE"],
+        timeout=app.config["DB_POOL_TIMEOUT"],
+        pragmas=app.config["DB_PRAGMAS"],
+    )
+    # a read pool of 0 sends reads through the write connection
+    read_pool = None
+    if app.config["DB_READ_POOL_SIZE"]:
+        read_pool = ConnectionPool(
+            app.config["DATABASE_READ"] or database,
+            size=app.config["DB_READ_POOL_SIZE"],
+            timeout=app.config["DB_POOL_TIMEOUT"],
+            pragmas=app.config["DB_PRAGMAS"],
+            readonly=True,
+        )
+    app.extensions["db_read_pool"] = read_pool
+    app.teardown_appcontext(close_connection)
+    if app.config["DB_INSTRUMENT"]:
+        app.after_request(add_server_timing)
+
+    if app.config["DB_MIGRATE"]:
+        from models.migrations import migrate
+        db = Database(pool=app.extensions["db_pool"])
+        try:
+            migrate(db)
+        finally:
+            db.close()
+
+
+def get_pool():
+    return current_app.extensions["db_pool"]
+
+
+def get_read_pool():
+    return current_app.extensions["db_read_pool"]
+
+
+def open_db():
+    # a pooled Database that is not tied to the request, the caller has to close it
+    return Database(
+        pool=get_pool(),
+        read_pool=get_read_pool(),
+        instrument=current_app.config["DB_INSTRUMENT"],
+        slow_query_ms=current_app.config["DB_SLOW_QUERY_MS"],
+        timed=current_app.config["DB_TIME_STATEMENTS"],
+    )
+
+
+def get_db():
+    # one pooled connection per request, shared by every model and the auth middleware
+    if 'db' not in g:
+        g.db = open_db()
+    return g.db
+
+
+def closing_stream(db, iterable):
+    # streamed bodies are consumed after the request teardown ran, so the stream closes its own connection
+    try:
+        yield from iterable
+    finally:
+        db.close()
+
+
+def add_server_timing(response):
+    # db time of the request, then its most expensive statements, readable in the browser's network panel
+    db = g.get("db")
+    if db is None or not db.instrument:
+        return response
+    entries = [f'db;dur={db.query_time * 1000:.2f};desc="{db.statement_count} statements"']
+    for index, (sql, seconds, calls, rows) in enumerate(db.timing_summary(), start=1):
+        desc = sql[:80].replace("\\", "").replace('"', "'")
+        entries.append(f'db{index};dur={seconds * 1000:.2f};desc="{calls}x {rows} rows: {desc}"')
+    response.headers.add("Server-Timing", ", ".join(entries))
+    return response
+
+
+def close_connection(exception):
+    db = g.pop('db', None)
+    if db is not None:
+        db.close()
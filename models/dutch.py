@@ -1,35 +1,40 @@
-from models.db import Database
-from models.auth import Users
+from models.db import get_db
+from models.money import Money
+from models.settlement import STRATEGIES, balances_from, settle
 
 class Dutch:
-    def __init__(self):
-        self.db = Database("file.db")
+    def __init__(self, db=None):
+        self.db = db if db is not None else get_db()
 
-    def create_group(self, name, created_by, members, total_amount, spent_dict=None):
+    def create_group(self, name, created_by, members, total_amount, spent_dict=None, settlement_strategy="auto"):
         if not name or not created_by or not members or len(members) < 1 or not total_amount or not spent_dict:
             raise ValueError("Invalid data. A group must have a name, at least 1 member, and a total expense.")
 
-        user = Users()
-        added_members = []
+        if settlement_strategy not in STRATEGIES:
+            raise ValueError(f"Settlement strategy must be one of: {', '.join(STRATEGIES)}.")
+
+        # Resolve every member and the creator with one query instead of one per username
+        found = self._find_users(members, created_by)
+        by_username = {row["username"]: row["id"] for row in found}
+        creator_username = next((row["username"] for row in found if row["id"] == created_by), None)
 
-        # Get user_id for each username in members
+        added_members = []
         for username in members:
-            user_data = user.db.fetch_one("SELECT id FROM users WHERE username = ?", (username,))
-            if user_data:
-                added_members.append({"username": username, "user_id": user_data["id"]})
-            else:
+            if username not in by_username:
                 return {"error": f"User '{username}' not found."}
+            # the creator is added below, listing them as a member too would insert them twice
+            if by_username[username] != created_by and username not in [m["username"] for m in added_members]:
+                added_members.append({"username": username, "user_id": by_username[username]})
 
         # Add creator if not already in the list
-        creator_username = user.find_username_by_id(created_by)
-        
         if creator_username not in spent_dict:
             raise ValueError("Creator's spent amount must be provided in spent_dict.")
         added_members.append({"username": creator_username, "user_id": created_by})
 
-        # Validate total spending
-        total_spent = sum(spent_dict.values())
-        if total_spent != total_amount:
+        # Validate total spending, in cents so 33.33 + 66.67 really is 100
+        total = Money.parse(total_amount)
+        spent = {username: Money.parse(amount) for username, amount in spent_dict.items()}
+        if sum(spent.values()) != total:
             return {"error": "Total amount and individual contributions do not match."}
         
         existing_group = self.db.fetch_one(
@@ -40,47 +45,62 @@ class Dutch:
         if existing_group:
             return {"error": "You already have a group with this name."}
         try:
-            # Insert group
-            insert_group_query = """
-                INSERT INTO groups (name, created_by, total_amount, member_count)
-                VALUES (?, ?, ?, ?)
-            """
-            cursor = self.db.execute(insert_group_query, (name, created_by, total_amount, len(added_members)))
-            if cursor is None:
-                return {"error": "Failed to insert group."}
-
-            group_id = cursor.lastrowid
-
-            # Insert group members and transactions
-            for member in added_members:
-                spent = spent_dict.get(member["username"], 0)
-                
-                self.db.execute(
+            # the group, its members and the settlement are written as one unit
+            with self.db.transaction():
+                # Insert group
+                insert_group_query = """
+                    INSERT INTO groups (name, created_by, total_amount, member_count, settlement_strategy)
+                    VALUES (?, ?, ?, ?, ?)
+                """
+                cursor = self.db.execute(insert_group_query, (name, created_by, total.cents, len(added_members), settlement_strategy))
+                if cursor is None:
+                    return {"error": "Failed to insert group."}
+
+                group_id = cursor.lastrowid
+
+                # Insert group members and transactions
+                member_rows = [
+                    (group_id, member["user_id"], spent.get(member["username"], Money()).cents)
+                    for member in added_members
+                ]
+                self.db.executemany(
                     "INSERT INTO group_members (group_id, user_id, amount_spent) VALUES (?, ?, ?)",
-                    (group_id, member["user_id"], spent)
+                    member_rows
                 )
-
-                self.db.execute(
+                self.db.executemany(
                     "INSERT INTO group_transactions (group_id, user_id, amount_spent) VALUES (?, ?, ?)",
-                    (group_id, member["user_id"], spent)
+                    member_rows
                 )
-            
-            self.calculation(created_by, group_id)
-           
 
+                self.calculation(created_by, group_id)
 
             return {"message": "Group created successfully", "group_id": group_id}
 
         except Exception as e:
             return {"error": "Failed to create group", "details": str(e)}
    
+    def _find_users(self, usernames, user_id=None):
+        # id and username for all the given usernames (and optionally one user id) in a single query
+        usernames = list(dict.fromkeys(usernames))
+        conditions = []
+        params = []
+        if usernames:
+            conditions.append(f"username IN ({', '.join('?' for _ in usernames)})")
+            params.extend(usernames)
+        if user_id is not None:
+            conditions.append("id = ?")
+            params.append(user_id)
+        if not conditions:
+            return []
+        return self.db.fetch_all(f"SELECT id, username FROM users WHERE {' OR '.join(conditions)}", params)
+
     def get_all_groups(self, user_id):
         if not user_id:
             return {"error": "The user not found."}
         
-        query = "SELECT * FROM groups WHERE created_by = ?"
+        query = "SELECT id, name, created_by, total_amount, member_count FROM groups WHERE created_by = ?"
         rows = self.db.fetch_all(query, (user_id,))
-        response = [dict(row) for row in rows]
+        response = [{**dict(row), "total_amount": Money(row["total_amount"]).amount} for row in rows]
 
         return response
 
@@ -93,11 +113,14 @@ class Dutch:
         
         if not response:
             return{"error": "Group not found."}
-        return response
+        return {**dict(response), "total_amount": Money(response["total_amount"]).amount}
 
-    def update_group_by_id(self, user_id, group_id, name=None, total_amount=None, new_members=None, member_spending=None):
+    def update_group_by_id(self, user_id, group_id, name=None, total_amount=None, new_members=None, member_spending=None, settlement_strategy=None):
         if not user_id:
             return {"error": "The user not found."}
+
+        if settlement_strategy is not None and settlement_strategy not in STRATEGIES:
+            return {"error": f"Settlement strategy must be one of: {', '.join(STRATEGIES)}."}
         
         query = "SELECT * FROM groups WHERE id = ? AND created_by = ?"
         group = self.db.fetch_one(query, (group_id, user_id))
@@ -113,76 +136,102 @@ class Dutch:
             update_fields.append("name = ?")
             update_values.append(name)
 
-        if total_amount is not None and total_amount != group["total_amount"]:
+        total_cents = group["total_amount"]
+        if total_amount is not None:
+            try:
+                total_cents = Money.parse(total_amount).cents
+            except ValueError as e:
+                return {"error": str(e)}
+        if total_cents != group["total_amount"]:
             update_fields.append("total_amount = ?")
-            update_values.append(total_amount)
+            update_values.append(total_cents)
             total_changed = True
-        
-        if update_fields:
-            query = f"UPDATE groups SET {', '.join(update_fields)} WHERE id = ?"
-            self.db.execute(query, (*update_values, group_id))
-            
+
+        if settlement_strategy and settlement_strategy != group["settlement_strategy"]:
+            # the stored settlement was made by the old strategy, the next read recalculates it
+            update_fields.extend(["settlement_strategy = ?", "settlements_dirty = 1"])
+            update_values.append(settlement_strategy)
+
         failed_members = []
         added_members = []
-        
-        if new_members:
-            user = Users()
-            for member in new_members:
-                if not isinstance(member, dict) or "username" not in member:
-                    failed_members.append(str(member))
-                    continue
-                
-                username = member.get["username"]
-                amount_spent = member.get("spent", 0)
-                
-                user_data = user.db.fetch_one("SELECT id FROM users WHERE username = ?", (username,))
-                if not user_data:
-                    failed_members.append(username)
-                    continue
-                
-                member_id = user_data["id"]
-                
-                existing_member = self.db.fetch_one("SELECT * FROM group_members WHERE group_id = ? AND user_id = ?",
-                (group_id, member_id)
-                 )
-                if not existing_member:
-                    self.db.execute(
-                        "INSERT INTO group_members (group_id, user_id) VALUES (?, ?)",
-                        (group_id, member_id))
-                    added_members.append(username)
-                
-                    self.db.execute(
-                       "INSERT INTO group_transactions (group_id, user_id, amount_spent) VALUES (?, ?, ?)",
-                        (group_id, member_id, amount_spent)
-            )
-                    
         response = {"message": "Group updated successfully."}
+
+        try:
+            # either the whole update (fields, members, recalculation) is stored or none of it
+            with self.db.transaction():
+                if update_fields:
+                    query = f"UPDATE groups SET {', '.join(update_fields)} WHERE id = ?"
+                    self.db.execute(query, (*update_values, group_id))
+
+                if new_members:
+                    valid_members = []
+                    for member in new_members:
+                        if not isinstance(member, dict) or "username" not in member:
+                            failed_members.append(str(member))
+                            continue
+                        valid_members.append(member)
+
+                    # one lookup for all usernames and one for the current members
+                    found = {row["username"]: row["id"] for row in self._find_users([m["username"] for m in valid_members])}
+                    existing = {
+                        row["user_id"] for row in
+                        self.db.fetch_all("SELECT user_id FROM group_members WHERE group_id = ?", (group_id,))
+                    }
+
+                    new_rows = []
+                    for member in valid_members:
+                        username = member["username"]
+                        member_id = found.get(username)
+                        if member_id is None:
+                            failed_members.append(username)
+                            continue
+                        if member_id in existing:
+                            continue
+
+                        existing.add(member_id)
+                        added_members.append(username)
+                        new_rows.append((group_id, member_id, Money.parse(member.get("spent", 0)).cents))
+
+                    self.db.executemany(
+                        "INSERT INTO group_members (group_id, user_id) VALUES (?, ?)",
+                        [(group_id, member_id) for group_id, member_id, _ in new_rows]
+                    )
+                    self.db.executemany(
+                        "INSERT INTO group_transactions (group_id, user_id, amount_spent) VALUES (?, ?, ?)",
+                        new_rows
+                    )
+
+                if total_changed or added_members:
+                    # stored settlements are stale from here on, calculation() clears the flag again
+                    self.db.execute("UPDATE groups SET settlements_dirty = 1 WHERE id = ?", (group_id,))
+
+                    #we select from transaction the sum becouse in groups table we are try to change it and it consider the uodate amount.
+                    # only the spending rows count, settlement rows (from_user set) are not money spent
+                    total_spent = self.db.fetch_one(
+                        "SELECT COALESCE(SUM(amount_spent), 0) as total FROM group_transactions WHERE group_id = ? AND from_user IS NULL",
+                        (group_id,)
+                    )["total"]
+                    # both sides are integer cents, no tolerance needed
+                    if total_spent != total_cents:
+                        raise ValueError("Please update spending, its more or less than current total.")
+                    try:
+
+                       result = self.calculation(user_id, group_id)
+                       response["recaculated"] = True
+                       response ["new_transactions"] = result.get("transaction", [])
+
+                    except Exception as e:
+                        response["recalculated"] = False
+                        response["calculation_error"] = str(e)
+
+        except ValueError as e:
+            return {"error": str(e)}
+
         if added_members:
            response["new_members_added"] = added_members
         if failed_members:
             response["failed_to_add"] = failed_members
-            
-        if total_changed or added_members:
-            #we select from transaction the sum becouse in groups table we are try to change it and it consider the uodate amount.
-            total_spent = self.db.fetch_one(
-                "SELECT SUM(amount) as total FROM group_transactions WHERE group_id = ?",
-                (group_id,)
-            )["total"]
-            # for small differences
-            if total_spent != total_amount:
-                return {
-                    "error": "Please update spending, its more or less than current total."
-                }
-            try:
-                
-               result = self.calculation(user_id, group_id)
-               response["recaculated"] = True
-               response ["new_transactions"] = result.get("transaction", [])
-               
-            except Exception as e:
-                response["recalculated"] = False
-                response["calculation_error"] = str(e)
-            
+
         return response
     
     def delete_group_by_id(self, user_id, group_id):
@@ -201,77 +250,87 @@ class Dutch:
         return {"message": "Group deleted successfully."}
     
     def calculation(self, user_id, group_id):
+        # reads and the rewrite of the settlement rows happen under one write lock and one commit
+        with self.db.transaction():
+            return self._calculate(user_id, group_id)
+
+    def _calculate(self, user_id, group_id):
     # Step 1: Verify the group exists and the user has access
         group = self.db.fetch_one("SELECT * FROM groups WHERE id = ? AND created_by = ?", (group_id, user_id))
         if not group:
             return {"error": "Group not found or you don't have permission."}
 
-        total_amount = group["total_amount"]
-    # Step 2: Fetch all group member IDs
-        members = self.db.fetch_all("SELECT user_id, amount_spent FROM group_members WHERE group_id = ?", (group_id,))
+        total_cents = group["total_amount"]
+    # Step 2: Fetch all group members with what they spent, one grouped query for the whole group
+        members = self.db.fetch_all("""
+            SELECT gm.user_id, COALESCE(SUM(gt.amount_spent), 0) AS paid
+            FROM group_members gm
+            LEFT JOIN group_transactions gt ON gt.group_id = gm.group_id AND gt.user_id = gm.user_id
+            WHERE gm.group_id = ?
+            GROUP BY gm.user_id
+        """, (group_id,))
         
         if not members or len(members) < 2:
+            # nothing to settle, store that so reads don't retry every time
+            self._store_settlements(group_id, [])
             return {"error": "A minimum of 2 members is required for calculation."}
 
-        member_ids = [member["user_id"] for member in members]
-                
-        per_person_share = total_amount / len(member_ids)
-    # Step 3: Initialize balances
-        balances = []
-        for member in members:
-            user_id = member["user_id"]
-            spent_data = self.db.fetch_one(
-              "SELECT amount_spent FROM group_transactions WHERE group_id = ? AND user_id = ?",
-               (group_id, user_id)
-            )
-            paid = spent_data["amount_spent"] if spent_data else 0
-           
-            balance = round(paid - per_person_share, 2)
-           
-            balances.append({
-            "user_id": user_id,
-            "paid": paid,
-            "balance": balance 
-        })
-    # Step 4: Separate debtors and creditors
-        debtors = [b for b in balances if b["balance"] < 0]
-        creditors = [b for b in balances if b["balance"] > 0]
-
-    # Step 5: Match payers (debtors) with those who should receive (creditors)
-        transactions = []
-                
-        for debtor in debtors:
-         amount_to_pay = -debtor["balance"]
-         for creditor in creditors:
-            if amount_to_pay == 0:
-                break
-            if creditor["balance"] <= 0:
-                continue
-
-            amount = min(amount_to_pay, creditor["balance"])
-            transactions.append({
-                "from_user": debtor["user_id"],
-                "to_user": creditor["user_id"],
-                "amount": round(amount, 2)
-            })
-
-            amount_to_pay -= amount
-            creditor["balance"] -= amount
-    # Step 6: (Optional cleanup) Remove previous transactions with from_user set
+    # Step 3: What everyone paid, stored in cents already
+        paid = {member["user_id"]: member["paid"] for member in members}
+
+    # Step 4: Balance against an equal share, the leftover cents of the split are spread so nothing is lost
+        balances = balances_from(paid, total_cents)
+
+    # Step 5: Let the group's settlement strategy turn balances into transfers
+        transfers = settle(balances, group["settlement_strategy"])
+        transactions = [{
+            "from_user": from_user,
+            "to_user": to_user,
+            "amount": Money(cents).amount
+        }
+        for from_user, to_user, cents in transfers
+        ]
+    # Step 6 and 7: Replace the stored settlement with the new one
+        self._store_settlements(group_id, transfers)
+        return {
+        "message": "Calculation completed successfully.",
+        "transactions": transactions
+    }
+
+    def _store_settlements(self, group_id, transfers):
+        # Remove previous transactions with from_user set
         self.db.execute(
            "DELETE FROM group_transactions WHERE group_id = ? AND from_user IS NOT NULL",
         (group_id,)
         )
 
-    # Step 7: Insert new calculated transactions into the database
-        for tx in transactions:
-           self.db.execute(
+        # Insert new calculated transactions into the database in one batch
+        self.db.executemany(
             "INSERT INTO group_transactions (group_id, from_user, to_user, amount) VALUES (?, ?, ?, ?)",
-            (group_id, tx["from_user"], tx["to_user"], tx["amount"])
+            [(group_id, from_user, to_user, cents) for from_user, to_user, cents in transfers]
+        )
+        self.db.execute("UPDATE groups SET settlements_dirty = 0 WHERE id = ?", (group_id,))
+
+    def get_settlements(self, user_id, group_id):
+        """ Settlement of a group for reads: served from storage, only recalculated when it is stale. """
+        group = self.db.fetch_one(
+            "SELECT settlements_dirty FROM groups WHERE id = ? AND created_by = ?", (group_id, user_id)
+        )
+        if not group:
+            return {"error": "Group not found or you don't have permission."}
+
+        if group["settlements_dirty"]:
+            return self.calculation(user_id, group_id)
+
+        rows = self.db.fetch_all(
+            "SELECT from_user, to_user, amount FROM group_transactions WHERE group_id = ? AND from_user IS NOT NULL ORDER BY id",
+            (group_id,)
         )
         return {
-        "message": "Calculation completed successfully.",
-        "transactions": transactions
-    }
+            "message": "Settlement loaded.",
+            "transactions": [
+                {"from_user": row["from_user"], "to_user": row["to_user"], "amount": Money(row["amount"]).amount}
+                for row in rows
+            ]
+        }
 
-    
\ No newline at end of file
@@ -0,0 +1,136 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+import bcrypt
+from flask import current_app, has_app_context
+
+DEFAULT_ROUNDS = 12
+
+
+class HashingBusy(Exception):
+    """ Raised when the hashing queue is full, routes turn it into a 503. """
+
+
+class PasswordHasher:
+    """ Runs bcrypt on a small fixed pool of threads.
+
+    bcrypt releases the GIL, so `workers` hashes really run in parallel, but never more than that:
+    a burst of logins queues here instead of taking every request thread and CPU core.
+    Once `max_pending` calls are queued or running, new ones fail right away with HashingBusy.
+    """
+
+    def __init__(self, workers=2, max_pending=32, rounds=DEFAULT_ROUNDS, timeout=10.0):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.rounds = rounds
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._running = 0
+        self._completed = 0
+        self._rejected = 0
+        self._timeouts = 0
+        self._wait_total = 0.0
+        self._run_total = 0.0
+        self._max_wait = 0.0
+
+    def hash(self, password):
+        salt = bcrypt.gensalt(rounds=self.rounds)
+        return self._submit(bcrypt.hashpw, password.encode('utf-8'), salt)
+
+    def verify(self, password, hashed):
+        if isinstance(hashed, str):
+            hashed = hashed.encode('utf-8')
+        return self._submit(bcrypt.checkpw, password.encode('utf-8'), hashed)
+
+    def _submit(self, function, *args):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._rejected += 1
+            raise HashingBusy("Too many logins in progress, try again shortly.")
+
+        with self._lock:
+            self._pending += 1
+        queued = time.perf_counter()
+
+        def work():
+            started = time.perf_counter()
+            with self._lock:
+                self._running += 1
+                wait = started - queued
+                self._wait_total += wait
+                self._max_wait = max(self._max_wait, wait)
+            try:
+                return function(*args)
+            finally:
+                with self._lock:
+                    self._running -= 1
+                    self._pending -= 1
+                    self._completed += 1
+                    self._run_total += time.perf_counter() - started
+                self._slots.release()
+
+        future = self._executor.submit(work)
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            with self._lock:
+                self._timeouts += 1
+            if future.cancel():
+                # never started, give its slot back here since work() won't run
+                with self._lock:
+                    self._pending -= 1
+                self._slots.release()
+            raise HashingBusy("Too many logins in progress, try again shortly.")
+
+    def stats(self):
+        with self._lock:
+            completed = self._completed or 1
+            return {
+                "workers": self.workers,
+                "rounds": self.rounds,
+                "max_pending": self.max_pending,
+                "pending": self._pending,
+                "running": self._running,
+                "queued": self._pending - self._running,
+                "completed": self._completed,
+                "rejected": self._rejected,
+                "timeouts": self._timeouts,
+                "avg_wait_ms": self._wait_total / completed * 1000,
+                "max_wait_ms": self._max_wait * 1000,
+                "avg_hash_ms": self._run_total / completed * 1000,
+            }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+
+# used outside an app (scripts, benchmarks), created on first use
+_default_hasher = None
+_default_lock = threading.Lock()
+
+
+def init_app(app):
+    app.config.setdefault("BCRYPT_ROUNDS", DEFAULT_ROUNDS)
+    app.config.setdefault("PASSWORD_HASH_WORKERS", 2)
+    app.config.setdefault("PASSWORD_HASH_MAX_PENDING", 32)
+    app.config.setdefault("PASSWORD_HASH_TIMEOUT", 10.0)
+
+    app.extensions["password_hasher"] = PasswordHasher(
+        workers=app.config["PASSWORD_HASH_WORKERS"],
+        max_pending=app.config["PASSWORD_HASH_MAX_PENDING"],
+        rounds=app.config["BCRYPT_ROUNDS"],
+        timeout=app.config["PASSWORD_HASH_TIMEOUT"],
+    )
+
+
+def get_hasher():
+    global _default_hasher
+    if has_app_context() and "password_hasher" in current_app.extensions:
+        return current_app.extensions["password_hasher"]
+    with _default_lock:
+        if _default_hasher is None:
+            _default_hasher = PasswordHasher()
+        return _default_hasher
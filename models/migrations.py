@@ -0,0 +1,310 @@
+""" Versioned schema migrations.
+
+The applied version is kept in sqlite's PRAGMA user_version. Every migration runs in its own
+transaction, so a failing step leaves the database at the previous version.
+Add new steps to the end of MIGRATIONS, never edit one that has already shipped.
+"""
+
+def _rebuild(table, create, copy):
+    # sqlite can't change a column type in place: build the new table, copy the rows over
+    # (keeping the AUTOINCREMENT counter) and swap it in. Needs foreign_keys off, which is sqlite's default.
+    return [
+        create,
+        f"INSERT INTO {table}_new {copy}",
+        f"DELETE FROM sqlite_sequence WHERE name = '{table}_new'",
+        f"INSERT INTO sqlite_sequence (name, seq) SELECT '{table}_new', seq FROM sqlite_sequence WHERE name = '{table}'",
+        f"DROP TABLE {table}",
+        f"ALTER TABLE {table}_new RENAME TO {table}",
+    ]
+
+MIGRATIONS = [
+    (1, "initial schema", [
+        """
+        CREATE TABLE IF NOT EXISTS users(
+               id INTEGER PRIMARY KEY AUTOINCREMENT,
+               username TEXT UNIQUE NOT NULL CHECK(length(username)>= 3 AND length(username) <= 20),
+               email TEXT UNIQUE NOT NULL CHECK(length(email) <= 50),
+               password TEXT NOT NULL,
+               created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+         )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS categories(
+                   id INTEGER PRIMARY KEY AUTOINCREMENT,
+                   name TEXT NOT NULL CHECK(length(name) > 0),
+                   type TEXT CHECK(type IN('income', 'expense')) NOT NULL,
+                   user_id INTEGER,
+                   FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+                   UNIQUE(name, user_id)
+        )
+        """,
+        # UNIQUE(name, user_id) never matches for user_id NULL (NULLs are distinct), so ON CONFLICT
+        # can't keep the global categories from being added again to a database made by the old init_db.py
+        """
+        WITH defaults(name, type) AS (VALUES
+            ('Salary', 'income'),
+            ('Gift', 'income'),
+            ('Food', 'expense'),
+            ('Rent', 'expense'),
+            ('Transport', 'expense'),
+            ('Entertainment', 'expense'),
+            ('Shopping', 'expense')
+        )
+        INSERT INTO categories (name, type)
+        SELECT name, type FROM defaults
+        WHERE NOT EXISTS (SELECT 1 FROM categories WHERE user_id IS NULL AND categories.name = defaults.name);
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS transactions(
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER NOT NULL,
+                    category_id INTEGER NOT NULL,
+                    amount REAL NOT NULL,  -- Positive for income, negative for expenses
+                    description TEXT,
+                    date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+                    FOREIGN KEY (category_id) REFERENCES categories(id) ON DELETE CASCADE
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS groups(
+                   id INTEGER PRIMARY KEY AUTOINCREMENT,
+                   name TEXT NOT NULL,
+                   created_by INTEGER NOT NULL,
+                   total_amount REAL DEFAULT 0,
+                   member_count INTEGER DEFAULT 1,
+                   FOREIGN KEY (created_by) REFERENCES users(id) ON DELETE CASCADE
+                   UNIQUE(name, created_by)  -- This line ensures no duplicate group name per user
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS group_members (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            group_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            amount_spent REAL DEFAULT 0,
+            FOREIGN KEY (group_id) REFERENCES groups(id) ON DELETE CASCADE,
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+            UNIQUE (group_id, user_id)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS group_transactions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            group_id INTEGER NOT NULL,
+            user_id INTEGER, -- optional for spent
+            amount_spent REAL, -- optional for spent
+            from_user INTEGER, -- for debt calculations
+            to_user INTEGER,   -- for debt calculations
+            amount REAL,       -- for debt calculations
+            description TEXT,
+            date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (group_id) REFERENCES groups(id) ON DELETE CASCADE,
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+            FOREIGN KEY (from_user) REFERENCES users(id),
+            FOREIGN KEY (to_user) REFERENCES users(id)
+        )
+        """,
+    ]),
+    (2, "indexes for the hot query paths", [
+        # transaction list, newest first
+        "CREATE INDEX IF NOT EXISTS idx_transactions_user_date ON transactions(user_id, date)",
+        # per-user chart, answered from the index alone
+        "CREATE INDEX IF NOT EXISTS idx_transactions_user_category ON transactions(user_id, category_id, amount)",
+        # compare chart, filters on category first and skips the caller
+        "CREATE INDEX IF NOT EXISTS idx_transactions_category_user ON transactions(category_id, user_id, amount)",
+        # dutch balances
+        "CREATE INDEX IF NOT EXISTS idx_group_transactions_group_user ON group_transactions(group_id, user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_groups_created_by ON groups(created_by)",
+    ]),
+    (3, "index for transaction pages filtered by category", [
+        "CREATE INDEX IF NOT EXISTS idx_transactions_user_category_date ON transactions(user_id, category_id, date)",
+    ]),
+    (4, "per user, category and month aggregates for the charts", [
+        """
+        CREATE TABLE IF NOT EXISTS category_totals(
+            user_id INTEGER NOT NULL,
+            category_id INTEGER NOT NULL,
+            month TEXT NOT NULL,  -- YYYY-MM of the transaction date
+            total_amount REAL NOT NULL DEFAULT 0,
+            tx_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, category_id, month)
+        ) WITHOUT ROWID
+        """,
+        """
+        INSERT INTO category_totals (user_id, category_id, month, total_amount, tx_count)
+        SELECT user_id, category_id, substr(date, 1, 7), SUM(amount), COUNT(*)
+        FROM transactions
+        GROUP BY user_id, category_id, substr(date, 1, 7)
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_category_totals_category ON category_totals(category_id, user_id, total_amount)",
+        # the charts no longer read transactions, these only slowed down inserts
+        "DROP INDEX IF EXISTS idx_transactions_user_category",
+        "DROP INDEX IF EXISTS idx_transactions_category_user",
+    ]),
+    (5, "stored group settlements with a staleness flag", [
+        # 1 until calculation() has stored the settlement for the current members and spending
+        "ALTER TABLE groups ADD COLUMN settlements_dirty INTEGER NOT NULL DEFAULT 1",
+    ]),
+    (6, "settlement strategy per group", [
+        # one of models.settlement.STRATEGIES
+        "ALTER TABLE groups ADD COLUMN settlement_strategy TEXT NOT NULL DEFAULT 'auto'",
+    ]),
+    (7, "money as integer cents", [
+        *_rebuild("transactions", """
+        CREATE TABLE transactions_new(
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER NOT NULL,
+                    category_id INTEGER NOT NULL,
+                    amount INTEGER NOT NULL,  -- cents, positive for income, negative for expenses
+                    description TEXT,
+                    date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+                    FOREIGN KEY (category_id) REFERENCES categories(id) ON DELETE CASCADE
+        )
+        """, "SELECT id, user_id, category_id, CAST(ROUND(amount * 100) AS INTEGER), description, date FROM transactions"),
+        "CREATE INDEX IF NOT EXISTS idx_transactions_user_date ON transactions(user_id, date)",
+        "CREATE INDEX IF NOT EXISTS idx_transactions_user_category_date ON transactions(user_id, category_id, date)",
+        *_rebuild("groups", """
+        CREATE TABLE groups_new(
+                   id INTEGER PRIMARY KEY AUTOINCREMENT,
+                   name TEXT NOT NULL,
+                   created_by INTEGER NOT NULL,
+                   total_amount INTEGER DEFAULT 0,  -- cents
+                   member_count INTEGER DEFAULT 1,
+                   settlements_dirty INTEGER NOT NULL DEFAULT 1,
+                   settlement_strategy TEXT NOT NULL DEFAULT 'auto',
+                   FOREIGN KEY (created_by) REFERENCES users(id) ON DELETE CASCADE
+                   UNIQUE(name, created_by)
+        )
+        """, "SELECT id, name, created_by, CAST(ROUND(total_amount * 100) AS INTEGER), member_count, "
+             "settlements_dirty, settlement_strategy FROM groups"),
+        "CREATE INDEX IF NOT EXISTS idx_groups_created_by ON groups(created_by)",
+        *_rebuild("group_members", """
+        CREATE TABLE group_members_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            group_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            amount_spent INTEGER DEFAULT 0,  -- cents
+            FOREIGN KEY (group_id) REFERENCES groups(id) ON DELETE CASCADE,
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+            UNIQUE (group_id, user_id)
+        )
+        """, "SELECT id, group_id, user_id, CAST(ROUND(amount_spent * 100) AS INTEGER) FROM group_members"),
+        *_rebuild("group_transactions", """
+        CREATE TABLE group_transactions_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            group_id INTEGER NOT NULL,
+            user_id INTEGER, -- optional for spent
+            amount_spent INTEGER, -- cents, optional for spent
+            from_user INTEGER, -- for debt calculations
+            to_user INTEGER,   -- for debt calculations
+            amount INTEGER,    -- cents, for debt calculations
+            description TEXT,
+            date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (group_id) REFERENCES groups(id) ON DELETE CASCADE,
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+            FOREIGN KEY (from_user) REFERENCES users(id),
+            FOREIGN KEY (to_user) REFERENCES users(id)
+        )
+        """, "SELECT id, group_id, user_id, CAST(ROUND(amount_spent * 100) AS INTEGER), from_user, to_user, "
+             "CAST(ROUND(amount * 100) AS INTEGER), description, date FROM group_transactions"),
+        "CREATE INDEX IF NOT EXISTS idx_group_transactions_group_user ON group_transactions(group_id, user_id)",
+        # the totals are sums of the rounded amounts, recount them instead of converting
+        "DROP TABLE category_totals",
+        """
+        CREATE TABLE category_totals(
+            user_id INTEGER NOT NULL,
+            category_id INTEGER NOT NULL,
+            month TEXT NOT NULL,  -- YYYY-MM of the transaction date
+            total_amount INTEGER NOT NULL DEFAULT 0,  -- cents
+            tx_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, category_id, month)
+        ) WITHOUT ROWID
+        """,
+        """
+        INSERT INTO category_totals (user_id, category_id, month, total_amount, tx_count)
+        SELECT user_id, category_id, substr(date, 1, 7), SUM(amount), COUNT(*)
+        FROM transactions
+        GROUP BY user_id, category_id, substr(date, 1, 7)
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_category_totals_category ON category_totals(category_id, user_id, total_amount)",
+    ]),
+    (8, "lower-case email for index lookups at login", [
+        # kept in sync by sqlite itself, emails were stored as typed
+        "ALTER TABLE users ADD COLUMN email_lower TEXT GENERATED ALWAYS AS (lower(email)) VIRTUAL",
+        "CREATE INDEX IF NOT EXISTS idx_users_email_lower ON users(email_lower)",
+    ]),
+]
+
+# Queries that run on every request of a busy endpoint. None of them may fall back to a table scan.
+HOT_QUERIES = {
+    "transactions page": (
+        "SELECT * FROM transactions WHERE user_id = ? AND (date, id) < (?, ?) ORDER BY date DESC, id DESC LIMIT ?",
+        (1, "2024-01-01", 1, 100)),
+    "transactions page by category": (
+        "SELECT * FROM transactions WHERE user_id = ? AND category_id = ? AND date >= ? "
+        "ORDER BY date DESC, id DESC LIMIT ?", (1, 1, "2024-01-01", 100)),
+    "user chart": (
+        "SELECT category_id, SUM(total_amount) AS total_amount FROM category_totals WHERE user_id = ? GROUP BY category_id", (1,)),
+    "compare chart": (
+        "SELECT category_id, user_id, SUM(total_amount) AS total_amount FROM category_totals "
+        "WHERE category_id IN (?, ?, ?, ?, ?, ?, ?) GROUP BY category_id, user_id", (1, 2, 3, 4, 5, 6, 7)),
+    # Transaction._add_to_totals after an import (id > ?) and a single insert or update (id = ?)
+    "chart totals upkeep": (
+        "INSERT INTO category_totals (user_id, category_id, month, total_amount, tx_count) "
+        "SELECT user_id, category_id, substr(date, 1, 7), SUM(amount), COUNT(*) "
+        "FROM transactions NOT INDEXED WHERE id > ? "
+        "GROUP BY user_id, category_id, substr(date, 1, 7) "
+        "ON CONFLICT(user_id, category_id, month) DO UPDATE SET "
+        "total_amount = total_amount + excluded.total_amount, tx_count = tx_count + excluded.tx_count", (1,)),
+    "group balances": (
+        "SELECT gm.user_id, COALESCE(SUM(gt.amount_spent), 0) AS paid FROM group_members gm "
+        "LEFT JOIN group_transactions gt ON gt.group_id = gm.group_id AND gt.user_id = gm.user_id "
+        "WHERE gm.group_id = ? GROUP BY gm.user_id", (1,)),
+    "current members": (
+        "SELECT user_id FROM group_members WHERE group_id = ?", (1,)),
+    "group member lookup": (
+        "SELECT id, username FROM users WHERE username IN (?, ?) OR id = ?", ("a", "b", 1)),
+    "stored settlement": (
+        "SELECT from_user, to_user, amount FROM group_transactions WHERE group_id = ? AND from_user IS NOT NULL ORDER BY id", (1,)),
+    "groups by creator": (
+        "SELECT * FROM groups WHERE created_by = ?", (1,)),
+    "login lookup": (
+        "SELECT id, password FROM users WHERE username = ? "
+        "UNION ALL SELECT id, password FROM users WHERE email_lower = lower(?) LIMIT 1", ("name", "name")),
+    "registration check": (
+        "SELECT id FROM users WHERE username IN (?, ?) "
+        "UNION ALL SELECT id FROM users WHERE email_lower IN (lower(?), lower(?)) LIMIT 1", ("name", "a@b.c", "a@b.c", "name")),
+}
+
+
+def current_version(db):
+    return db.fetch_one("PRAGMA user_version", ())[0]
+
+
+def migrate(db, target=None):
+    """ Apply every migration newer than the database, returns the versions that were applied. """
+    version = current_version(db)
+    applied = []
+    for number, name, statements in MIGRATIONS:
+        if number <= version or (target is not None and number > target):
+            continue
+        with db.transaction():
+            for statement in statements:
+                db.execute(statement)
+            db.execute(f"PRAGMA user_version = {number}")
+        applied.append(number)
+    return applied
+
+
+def check_query_plans(db, queries=None):
+    """ Run EXPLAIN QUERY PLAN on the hot queries and return the ones that scan a whole table. """
+    scans = []
+    for name, (query, params) in (queries or HOT_QUERIES).items():
+        plan = db.fetch_all(f"EXPLAIN QUERY PLAN {query}", params)
+        for row in plan:
+            detail = row["detail"]
+            if detail.startswith("SCAN ") and "CONSTANT ROW" not in detail:
+                scans.append((name, detail))
+    return scans
@@ -0,0 +1,86 @@
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+
+# 1,000,000,000.00. Far above any real amount, and far enough below sqlite's 64-bit INTEGER
+# that the SUM()s over many of them can't overflow either
+MAX_CENTS = 100_000_000_000
+
+class Money:
+    """ An amount of money as integer cents, the way it is stored in the database.
+
+    Money.parse(12.5) reads a user supplied amount, Money(1250) wraps a stored value,
+    .amount gives the float the API returns.
+    """
+    __slots__ = ("cents",)
+
+    def __init__(self, cents=0):
+        self.cents = int(cents or 0)
+
+    @classmethod
+    def parse(cls, value):
+        # go through str so 0.1 is read as 0.1 and not as its binary float approximation
+        if isinstance(value, bool) or value is None:
+            raise ValueError("Amount must be a number.")
+        try:
+            decimal = Decimal(str(value).strip())
+        except InvalidOperation:
+            raise ValueError("Amount must be a number.")
+        # checked before quantize, which raises InvalidOperation itself on huge values like 1e30
+        if not decimal.is_finite() or abs(decimal) * 100 > MAX_CENTS:
+            raise ValueError("Amount must be a number.")
+        try:
+            return cls(int((decimal * 100).quantize(Decimal(1), rounding=ROUND_HALF_UP)))
+        except InvalidOperation:
+            raise ValueError("Amount must be a number.")
+
+    @property
+    def amount(self):
+        return self.cents / 100
+
+    def __add__(self, other):
+        if isinstance(other, Money):
+            return Money(self.cents + other.cents)
+        if other == 0:
+            return self
+        return NotImplemented
+
+    # lets sum() start from 0
+    __radd__ = __add__
+
+    def __sub__(self, other):
+        if isinstance(other, Money):
+            return Money(self.cents - other.cents)
+        return NotImplemented
+
+    def __neg__(self):
+        return Money(-self.cents)
+
+    def __abs__(self):
+        return Money(abs(self.cents))
+
+    def __eq__(self, other):
+        return isinstance(other, Money) and self.cents == other.cents
+
+    def __lt__(self, other):
+        return self.cents < other.cents
+
+    def __le__(self, other):
+        return self.cents <= other.cents
+
+    def __gt__(self, other):
+        return self.cents > other.cents
+
+    def __ge__(self, other):
+        return self.cents >= other.cents
+
+    def __hash__(self):
+        return hash(self.cents)
+
+    def __bool__(self):
+        return self.cents != 0
+
+    def __repr__(self):
+        return f"Money({self.cents})"
+
+    def __str__(self):
+        sign = "-" if self.cents < 0 else ""
+        return f"{sign}{abs(self.cents) // 100}.{abs(self.cents) % 100:02d}"
@@ -0,0 +1,64 @@
+""" Statement budgets for the Dutch paths, so a per-member query sneaking back in is caught.
+
+Runs the model code against a scratch in-memory database with a 50-member group, the statement counts
+must not depend on the group size. Used by 'python init_db.py --check'.
+"""
+from models.db import Database, max_queries
+from models.dutch import Dutch
+from models.migrations import migrate
+
+GROUP_SIZE = 50
+
+# name -> most statements allowed
+QUERY_BUDGETS = {
+    "create group": 10,
+    "recalculation": 5,
+    "stored settlement read": 2,
+    # lookups, inserts and the spending check, then a recalculation
+    "add member": 12,
+}
+
+
+def check_query_budgets(budgets=None):
+    """ Returns [(name, message)] for every path over its budget. """
+    budgets = budgets or QUERY_BUDGETS
+    db = Database(":memory:")
+    failures = []
+    try:
+        migrate(db)
+        db.executemany(
+            "INSERT INTO users (username, email, password) VALUES (?, ?, ?)",
+            [(f"member{i}", f"member{i}@example.com", "-") for i in range(GROUP_SIZE + 1)],
+        )
+        dutch = Dutch(db)
+        creator = db.fetch_one("SELECT id FROM users WHERE username = ?", ("member0",))["id"]
+        members = [f"member{i}" for i in range(1, GROUP_SIZE)]
+
+        def run(name, call):
+            # an AssertionError leaves the call's result behind, later checks still need the group
+            results = []
+            try:
+                with max_queries(db, budgets[name]):
+                    results.append(call())
+            except AssertionError as e:
+                failures.append((name, str(e)))
+            result = results[0] if results else None
+            if isinstance(result, dict) and "error" in result:
+                failures.append((name, f"failed: {result['error']}"))
+            return result
+
+        created = run("create group", lambda: dutch.create_group(
+            "budget check", creator, members, GROUP_SIZE, {f"member{i}": 1 for i in range(GROUP_SIZE)}
+        ))
+        if not created or "group_id" not in created:
+            return failures
+        group_id = created["group_id"]
+
+        run("recalculation", lambda: dutch.calculation(creator, group_id))
+        run("stored settlement read", lambda: dutch.get_settlements(creator, group_id))
+        run("add member", lambda: dutch.update_group_by_id(
+            creator, group_id, new_members=[{"username": f"member{GROUP_SIZE}", "spent": 0}]
+        ))
+    finally:
+        db.close()
+    return failures
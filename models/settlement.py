@@ -0,0 +1,114 @@
+""" Debt simplification for Dutch groups.
+
+Everything here works on integer cents. A balance is what a member paid minus their share:
+positive means the group owes them money, negative means they owe the group.
+A strategy turns balances into transfers (from_user, to_user, cents).
+"""
+import heapq
+
+# groups with more non-zero balances than this always use the heap algorithm, even with "exact":
+# the exact search is O(2^n * n) in time and memory and runs while the write lock is held
+EXACT_LIMIT = 12
+
+def split_shares(total_cents, member_ids):
+    # equal shares, the leftover cents go one each to the lowest user ids so the shares add up exactly
+    member_ids = sorted(member_ids)
+    share, remainder = divmod(total_cents, len(member_ids))
+    return {user_id: share + (1 if index < remainder else 0) for index, user_id in enumerate(member_ids)}
+
+def balances_from(paid, total_cents):
+    shares = split_shares(total_cents, list(paid))
+    return {user_id: paid[user_id] - shares[user_id] for user_id in paid}
+
+def min_cash_flow(balances):
+    """ Always settle the biggest debtor against the biggest creditor, at most n - 1 transfers. """
+    creditors = [(-amount, user_id) for user_id, amount in balances.items() if amount > 0]
+    debtors = [(amount, user_id) for user_id, amount in balances.items() if amount < 0]
+    heapq.heapify(creditors)
+    heapq.heapify(debtors)
+
+    transfers = []
+    while creditors and debtors:
+        credit, creditor = heapq.heappop(creditors)
+        debt, debtor = heapq.heappop(debtors)
+        amount = min(-credit, -debt)
+        transfers.append((debtor, creditor, amount))
+
+        # whoever is not fully settled goes back on the heap with what is left
+        if -credit > amount:
+            heapq.heappush(creditors, (credit + amount, creditor))
+        if -debt > amount:
+            heapq.heappush(debtors, (debt + amount, debtor))
+    return transfers
+
+def min_transfers(balances):
+    """ Fewest possible transfers.
+
+    A set of members whose balances add up to zero can settle among themselves with size - 1
+    transfers, so the answer is members - (largest number of disjoint zero-sum sets). The sets are
+    found with a DP over subsets, then each one is settled with min_cash_flow.
+    Above EXACT_LIMIT non-zero balances the search is too expensive and min_cash_flow is used instead.
+    """
+    members = sorted(user_id for user_id, amount in balances.items() if amount != 0)
+    if len(members) > EXACT_LIMIT:
+        return min_cash_flow(balances)
+    if sum(balances[user_id] for user_id in members) != 0:
+        # money is missing or left over, there is no exact settlement to look for
+        return min_cash_flow(balances)
+
+    count = len(members)
+    full = (1 << count) - 1
+    sums = [0] * (full + 1)
+    for mask in range(1, full + 1):
+        lowest = (mask & -mask).bit_length() - 1
+        sums[mask] = sums[mask & (mask - 1)] + balances[members[lowest]]
+
+    # best[mask]: most zero-sum prefixes any ordering of `mask` can have
+    best = [0] * (full + 1)
+    for mask in range(1, full + 1):
+        value = 0
+        bits = mask
+        while bits:
+            bit = bits & -bits
+            value = max(value, best[mask ^ bit])
+            bits ^= bit
+        best[mask] = value + (1 if sums[mask] == 0 else 0)
+
+    # walk back from the full set, every time the remaining set sums to zero a group is closed
+    groups = []
+    current = []
+    mask = full
+    while mask:
+        bits = mask
+        while bits:
+            bit = bits & -bits
+            if best[mask ^ bit] + (1 if sums[mask] == 0 else 0) == best[mask]:
+                break
+            bits ^= bit
+        if sums[mask] == 0 and current:
+            groups.append(current)
+            current = []
+        current.append(members[bit.bit_length() - 1])
+        mask ^= bit
+    if current:
+        groups.append(current)
+
+    transfers = []
+    for group in groups:
+        transfers.extend(min_cash_flow({user_id: balances[user_id] for user_id in group}))
+    return transfers
+
+def auto(balances):
+    # min_transfers already falls back to min_cash_flow for large groups
+    return min_transfers(balances)
+
+STRATEGIES = {
+    "auto": auto,
+    "greedy": min_cash_flow,
+    "exact": min_transfers,
+}
+
+def settle(balances, strategy="auto"):
+    if strategy not in STRATEGIES:
+        raise ValueError(f"Unknown settlement strategy '{strategy}'. Use one of: {', '.join(STRATEGIES)}.")
+    return STRATEGIES[strategy](balances)
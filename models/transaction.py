@@ -1,9 +1,18 @@
-from models.db import Database
+import base64
+import datetime
+import json
+from models.db import get_db
+from models.cache import publish
+from models.money import Money
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+MAX_IMPORT_ROWS = 10000
 
 class Transaction:
 
-    def __init__(self):
-        self.db = Database('file.db')
+    def __init__(self, db=None):
+        self.db = db if db is not None else get_db()
 
     def create_category(self, user_id, category_name, category_type):
         if not category_name:
@@ -34,9 +43,18 @@ class Transaction:
         
         if not isinstance(amount, (int, float)) or amount <= 0:
           raise ValueError("Amount must be positive number.")
+
+        # stored as integer cents, anything that rounds to 0 is not a real amount
+        cents = Money.parse(amount).cents
+        if cents <= 0:
+          raise ValueError("Amount must be positive number.")
         
         if description and len(description) > 255:
             raise ValueError("Description is too long.")
+
+        # stored the way the filters and the page cursor compare dates
+        if date:
+            date = self.parse_date(date, "date")
         
         #check if user exists
         user_query = "SELECT id FROM users WHERE id = ?"
@@ -56,34 +74,209 @@ class Transaction:
         
         category_type = category["type"]
         if category_type == "expense" :
-            amount = -abs(amount)
-        else:
-            amount = abs(amount)
+            cents = -cents
         
         query = "INSERT INTO transactions(user_id, category_id, amount, description, date) VALUES (?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP))"
 
         try:
-            self.db.execute(query,(user_id, category_id, amount, description, date))
+            with self.db.transaction():
+                cursor = self.db.execute(query,(user_id, category_id, cents, description, date))
+                self._add_to_totals("id = ?", (cursor.lastrowid,))
+            publish("transactions_changed", user_id=user_id, category_ids=[category_id])
             return {"message": "Transaction created successfuly"}
         
         except Exception as e:
             return {"error": str(e)}
 
-    def get_transactions(self, user_id):
+    def _add_to_totals(self, where, params):
+        # fold the transactions matching `where` (a condition on id) into the per user/category/month aggregates
+        # the charts read. NOT INDEXED: otherwise sqlite walks a whole (user_id, ...) index for "id > ?" instead
+        # of the rowid range, on every import and while the write lock is held
+        self.db.execute(f"""
+        INSERT INTO category_totals (user_id, category_id, month, total_amount, tx_count)
+        SELECT user_id, category_id, substr(date, 1, 7), SUM(amount), COUNT(*)
+        FROM transactions NOT INDEXED WHERE {where}
+        GROUP BY user_id, category_id, substr(date, 1, 7)
+        ON CONFLICT(user_id, category_id, month) DO UPDATE SET
+            total_amount = total_amount + excluded.total_amount,
+            tx_count = tx_count + excluded.tx_count
+        """, params)
+
+    def _remove_from_totals(self, transaction):
+        # take an existing row out of its aggregate before it is changed
+        key = (transaction["user_id"], transaction["category_id"], transaction["date"])
+        self.db.execute("""
+        UPDATE category_totals SET total_amount = total_amount - ?, tx_count = tx_count - 1
+        WHERE user_id = ? AND category_id = ? AND month = substr(?, 1, 7)
+        """, (transaction["amount"], *key))
+        self.db.execute("""
+        DELETE FROM category_totals
+        WHERE user_id = ? AND category_id = ? AND month = substr(?, 1, 7) AND tx_count <= 0
+        """, key)
+
+    @staticmethod
+    def encode_cursor(transaction):
+        # opaque token pointing at the last row of a page, pages are ordered by (date, id) descending
+        raw = json.dumps([transaction["date"], transaction["id"]]).encode("utf-8")
+        return base64.urlsafe_b64encode(raw).decode("ascii")
+
+    @staticmethod
+    def decode_cursor(cursor):
+        try:
+            date, transaction_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        except Exception:
+            raise ValueError("Invalid cursor.")
+        if not isinstance(transaction_id, int):
+            raise ValueError("Invalid cursor.")
+        return date, transaction_id
+
+    @staticmethod
+    def parse_date(value, name):
+        # returned the way dates are stored and compared as text: "2024-01-31" for a bare date,
+        # "2024-01-31 10:00:00" (utc) otherwise. "2024-01-31T10:00" would sort after every time on the 31st
+        try:
+            return datetime.date.fromisoformat(value).isoformat()
+        except (TypeError, ValueError):
+            pass
+        try:
+            parsed = datetime.datetime.fromisoformat(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"'{name}' must be an ISO date like 2024-01-31.")
+        if parsed.tzinfo is not None:
+            parsed = parsed.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+        return parsed.strftime("%Y-%m-%d %H:%M:%S")
+
+    def _filters(self, user_id, date_from=None, date_to=None, category_id=None):
+        conditions = ["user_id = ?"]
+        params = [user_id]
+
+        if date_from:
+            date_from = self.parse_date(date_from, "from")
+            if date_from.endswith(" 00:00:00"):
+                # midnight is the whole day, which also keeps rows stored as a bare date
+                date_from = date_from[:10]
+            conditions.append("date >= ?")
+            params.append(date_from)
+
+        if date_to:
+            date_to = self.parse_date(date_to, "to")
+            if len(date_to) == 10:
+                # a bare date includes the whole day
+                conditions.append("date < ?")
+                params.append((datetime.date.fromisoformat(date_to) + datetime.timedelta(days=1)).isoformat())
+            else:
+                conditions.append("date <= ?")
+                params.append(date_to)
+
+        if category_id:
+            conditions.append("category_id = ?")
+            params.append(category_id)
+
+        return conditions, params
+
+    def import_transactions(self, user_id, rows):
+        """ Insert many transactions in one database transaction.
+
+        Invalid rows are skipped and reported as {"row": index, "error": message}, the valid ones are imported.
+        """
+        if not user_id:
+            raise ValueError("User ID is required.")
+        if not isinstance(rows, list) or not rows:
+            raise ValueError("Provide a non-empty list of transactions.")
+        if len(rows) > MAX_IMPORT_ROWS:
+            raise ValueError(f"At most {MAX_IMPORT_ROWS} transactions can be imported at once.")
+
+        # one lookup for every category the user may book on, instead of one per row
+        categories = {
+            row["id"]: row["type"]
+            for row in self.db.fetch_all(
+                "SELECT id, type FROM categories WHERE user_id = ? OR user_id IS NULL", (user_id,)
+            )
+        }
+
+        values = []
+        errors = []
+        for index, row in enumerate(rows):
+            try:
+                if not isinstance(row, dict):
+                    raise ValueError("Each transaction must be an object.")
+
+                try:
+                    category_id = int(row.get("category_id"))
+                except (TypeError, ValueError):
+                    raise ValueError("Category ID is required.")
+                if category_id not in categories:
+                    raise ValueError("category does not exist.")
+
+                amount = row.get("amount")
+                if not isinstance(amount, (str, int, float)):
+                    raise ValueError("Amount must be positive number.")
+                try:
+                    # csv amounts arrive as text, parsing them directly keeps "0.10" exact
+                    cents = Money.parse(amount).cents
+                except ValueError:
+                    raise ValueError("Amount must be positive number.")
+                if cents <= 0:
+                    raise ValueError("Amount must be positive number.")
+                cents = -cents if categories[category_id] == "expense" else cents
+
+                description = row.get("description") or ""
+                if not isinstance(description, str):
+                    raise ValueError("Description must be text.")
+                if len(description) > 255:
+                    raise ValueError("Description is too long.")
+
+                date = row.get("date") or None
+                if date:
+                    date = self.parse_date(date, "date")
+
+                values.append((user_id, category_id, cents, description, date))
+            except ValueError as e:
+                errors.append({"row": index, "error": str(e)})
+
+        query = "INSERT INTO transactions(user_id, category_id, amount, description, date) VALUES (?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP))"
+        if values:
+            with self.db.transaction():
+                # the write lock is held, so every row above this id is one of ours
+                last_id = self.db.fetch_one("SELECT COALESCE(MAX(id), 0) FROM transactions", ())[0]
+                self.db.executemany(query, values)
+                self._add_to_totals("id > ?", (last_id,))
+            publish("transactions_changed", user_id=user_id, category_ids=sorted({row[1] for row in values}))
+
+        return {"imported": len(values), "errors": errors}
+
+    def get_transactions(self, user_id, limit=None, cursor=None, date_from=None, date_to=None, category_id=None):
         #check the user 
         if not user_id:
             return {"error": "User ID is required."}
-        
-        query = "SELECT * FROM transactions WHERE user_id = ?"
+
+        limit = DEFAULT_PAGE_SIZE if limit is None else limit
+        if not isinstance(limit, int) or limit < 1 or limit > MAX_PAGE_SIZE:
+            raise ValueError(f"Limit must be between 1 and {MAX_PAGE_SIZE}.")
+
+        conditions, params = self._filters(user_id, date_from, date_to, category_id)
+
+        if cursor:
+            # keyset pagination: continue right after the last row of the previous page
+            conditions.append("(date, id) < (?, ?)")
+            params.extend(self.decode_cursor(cursor))
+
+        query = f"""
+        SELECT id, user_id, category_id, amount, description, date FROM transactions
+        WHERE {' AND '.join(conditions)}
+        ORDER BY date DESC, id DESC
+        LIMIT ?
+        """
+        params.append(limit)
     
         try:
-         result = self.db.fetch_all(query, (user_id,))
+         result = self.db.fetch_all(query, params)
 
          transactions = [{
             "id" : row["id"],
             "user_id" : row["user_id"],
             "category_id": row["category_id"],
-            "amount": row["amount"],
+            "amount": Money(row["amount"]).amount,
             "description": row["description"],
             "date": row["date"]
 
@@ -94,6 +287,28 @@ class Transaction:
         
         except Exception as e:
             return {"error": str(e)}
+
+    def iter_transactions(self, user_id, date_from=None, date_to=None, category_id=None):
+        """ Lazily yield the user's whole history oldest first, for exports. """
+        if not user_id:
+            raise ValueError("User ID is required.")
+
+        # filters are validated here, before the response starts streaming
+        conditions, params = self._filters(user_id, date_from, date_to, category_id)
+        query = f"""
+        SELECT id, category_id, amount, description, date FROM transactions
+        WHERE {' AND '.join(conditions)}
+        ORDER BY date, id
+        """
+        return ({
+            "id": row["id"],
+            "category_id": row["category_id"],
+            "amount": Money(row["amount"]).amount,
+            "description": row["description"],
+            "date": row["date"]
+        }
+        for row in self.db.iterate(query, params)
+        )
         
     def get_transaction_by_id(self, user_id, transaction_id):
         if not user_id or not transaction_id:
@@ -111,7 +326,7 @@ class Transaction:
               "id": result["id"],
               "user_id": result["user_id"],
               "category_id": result["category_id"],
-              "amount": result["amount"],
+              "amount": Money(result["amount"]).amount,
               "description": result["description"],
               "date": result["date"]
             }
@@ -142,12 +357,13 @@ class Transaction:
            return{"error": "Category not found or unauthorized."}, 404
 
      if amount is not None: 
-        if not isinstance(amount, (int, float)) or amount <= 0:
+        if not isinstance(amount, (int, float)) or isinstance(amount, bool) or amount <= 0:
+            return {"error": "Amount must be a positive number."}
+        amount = Money.parse(amount).cents
+        if amount <= 0:
             return {"error": "Amount must be a positive number."}
         if category_type == "expense":
-            amount = -abs(amount)
-        else:
-            amount = abs(amount)
+            amount = -amount
 
      update_fields = []
      values = []
@@ -168,6 +384,7 @@ class Transaction:
         values.append(description)
 
      if date:
+        date = self.parse_date(date, "date")
         update_fields.append("date = ?")
         values.append(date)
 
@@ -179,7 +396,11 @@ class Transaction:
      values.extend([transaction_id, user_id])
 
      try:
-      self.db.execute(update_query, values)
+      with self.db.transaction():
+        self._remove_from_totals(transaction)
+        self.db.execute(update_query, values)
+        self._add_to_totals("id = ?", (transaction_id,))
+      publish("transactions_changed", user_id=user_id, category_ids=[transaction["category_id"], category_id or transaction["category_id"]])
       return {"message": "Transaction updated successfully."}
      
      except Exception as e:
@@ -1,22 +1,30 @@
-from flask import Blueprint, request, jsonify
-from models.db import Database
+from flask import Blueprint, request, jsonify, Response, stream_with_context
 from models.auth import Users
-from models.transaction import Transaction
+from models.hashing import HashingBusy
+from models.transaction import Transaction, DEFAULT_PAGE_SIZE
 from middleware.auth import token_required
 from models.chart import Chart
+from models.db import open_db, closing_stream
 from models.dutch import Dutch
 import traceback
-from extensions import limiter 
+import csv
+import io
+import json
+from extensions import limiter, quota, request_cost
 
 
 auth_bp = Blueprint("auth", __name__, url_prefix="/auth")
 dashboard_bp = Blueprint("dashboard", __name__, url_prefix="/dashboard")
 dutch_bp = Blueprint("dutch", __name__)
 
-db = Database("file.db")
+# each blueprint has one budget shared by all its routes (see extensions.DEFAULT_QUOTAS), heavy endpoints cost more of it.
+# Route limits below use override_defaults=False so they add to the blueprint budget instead of replacing it.
+limiter.shared_limit(quota("auth"), scope="auth", cost=request_cost)(auth_bp)
+limiter.shared_limit(quota("dashboard"), scope="dashboard", cost=request_cost)(dashboard_bp)
+limiter.shared_limit(quota("dutch"), scope="dutch", cost=request_cost)(dutch_bp)
 
 @auth_bp.route("/register", methods=["POST"])
-@limiter.limit("3 per minute")
+@limiter.limit("3 per minute", override_defaults=False)
 def register():
     """
     User Registration
@@ -54,6 +62,8 @@ def register():
         description: Bad Request if any parameter is missing or invalid.
       500:
         description: Internal Server Error if something goes wrong.
+      503:
+        description: Too many password hashes in progress, retry after a moment.
     """
     data = request.get_json()
     username = data.get("username")
@@ -64,31 +74,26 @@ def register():
 
     try:
         result = user.create_user(username, email, password)
-        user_data = user.db.fetch_one(
-            "SELECT id FROM users WHERE email = ? OR username = ?", (email, username)
-        )
 
-        if not user_data:
-            return (
-                jsonify({"error": "Failed to retrieve user ID after registration"}),
-                500,
-            )
+        if "error" in result:
+            return jsonify(result), 500
 
-        user_id = user_data["id"]
+        user_id = result["user_id"]
         token = user.generate_token(user_id)
         return jsonify({"message": result["message"], "token": token}), 201
 
     except ValueError as ve:
         return jsonify({"error": str(ve)}), 400
 
+    except HashingBusy as e:
+        return jsonify({"error": str(e)}), 503, {"Retry-After": "1"}
+
     except Exception as e:
         traceback.print_exc()
         return jsonify({"error": "Something went wrong", "message": str(e)}), 500
-    finally:
-      user.db.close()
 
 @auth_bp.route("/login", methods=["POST"])
-@limiter.limit("5 per minute")
+@limiter.limit("5 per minute", override_defaults=False)
 def login():
     """
     User Login
@@ -123,6 +128,8 @@ def login():
         description: Unauthorized if the credentials are incorrect.
       500:
         description: Internal Server Error if something goes wrong.
+      503:
+        description: Too many password checks in progress, retry after a moment.
     """
     data = request.get_json()
     if not data:
@@ -139,26 +146,20 @@ def login():
     try:
 
         result = user.login_user(identifier, password)
-        user_data = user.db.fetch_one(
-            "SELECT id FROM users WHERE email = ? OR username = ?",
-            (identifier, identifier),
-        )
-
-        if not user_data:
-            return jsonify({"error": "Invalid credentials"}), 401
 
-        user_id = user_data["id"]
+        user_id = result["user_id"]
         token = user.generate_token(user_id)
         return jsonify({"message": result["message"], "token": token}), 200
 
     except ValueError as ve:
         return jsonify({"error": str(ve)}), 400
 
+    except HashingBusy as e:
+        return jsonify({"error": str(e)}), 503, {"Retry-After": "1"}
+
     except Exception as e:
         print("Error:", str(e))
         return jsonify({"error": "Something went wrong", "message": str(e)}), 500
-    finally:
-      user.db.close()
       
 @auth_bp.route("/refresh-token", methods=["POST"])
 def refresh_token():
@@ -296,8 +297,6 @@ def add_transaction(current_user):
 
     except Exception as e:
         return jsonify({"error": "Something went wrong.", "details": str(e)}), 500
-    finally:
-      transaction.db.close()
 
 @dashboard_bp.route("/transactions", methods=["GET"])
 @token_required
@@ -307,9 +306,41 @@ def get_all_transactions(current_user):
     ---
     security:
       - bearerAuth: []
+    parameters:
+      - in: query
+        name: limit
+        type: integer
+        required: false
+        description: Page size, 100 by default and at most 500.
+      - in: query
+        name: cursor
+        type: string
+        required: false
+        description: The X-Next-Cursor value of the previous page.
+      - in: query
+        name: from
+        type: string
+        format: date
+        required: false
+        description: Only transactions on or after this date.
+      - in: query
+        name: to
+        type: string
+        format: date
+        required: false
+        description: Only transactions on or before this date.
+      - in: query
+        name: category_id
+        type: integer
+        required: false
+        description: Only transactions in this category.
     responses:
       200:
-        description: Successfully fetched all transactions for the user
+        description: One page of the user's transactions, newest first. When more rows exist the X-Next-Cursor header holds the cursor for the next page.
+        headers:
+          X-Next-Cursor:
+            type: string
+            description: Cursor for the next page, missing on the last page.
         schema:
           type: array
           items:
@@ -367,16 +398,225 @@ def get_all_transactions(current_user):
 
     transaction = Transaction()
     try:
-        response = transaction.get_transactions(user_id)  # Fetch all transactions
-        return jsonify(response), 200
+        limit = request.args.get("limit", type=int)
+        if "limit" in request.args and limit is None:
+            return jsonify({"error": "Limit must be a number."}), 400
+
+        response = transaction.get_transactions(
+            user_id,
+            limit=limit,
+            cursor=request.args.get("cursor"),
+            date_from=request.args.get("from"),
+            date_to=request.args.get("to"),
+            category_id=request.args.get("category_id", type=int),
+        )
+        if "error" in response:
+            return jsonify(response), 400
+
+        result = jsonify(response)
+        # a full page means there may be more rows after it
+        if len(response) == (limit or DEFAULT_PAGE_SIZE):
+            result.headers["X-Next-Cursor"] = transaction.encode_cursor(response[-1])
+        return result, 200
+
+    except ValueError as ve:
+        return jsonify({"error": str(ve)}), 400
+
+    except Exception as e:
+        return jsonify({"error": "Something went wrong.", "details": str(e)}), 500
+
+EXPORT_FIELDS = ["id", "category_id", "amount", "description", "date"]
+
+def _ndjson_lines(rows):
+    for row in rows:
+        yield json.dumps(row) + "\n"
+
+def _csv_lines(rows):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS)
+    writer.writeheader()
+    for row in rows:
+        writer.writerow(row)
+        # hand each line to the response as soon as it is written
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate(0)
+    if buffer.tell():
+        yield buffer.getvalue()
+
+@dashboard_bp.route("/transactions/export", methods=["GET"])
+@token_required
+def export_transactions(current_user):
+    """
+    Export Transactions
+    ---
+    security:
+      - bearerAuth: []
+    parameters:
+      - in: query
+        name: format
+        type: string
+        enum:
+          - ndjson
+          - csv
+        required: false
+        description: Output format, ndjson by default.
+      - in: query
+        name: from
+        type: string
+        format: date
+        required: false
+        description: Only transactions on or after this date.
+      - in: query
+        name: to
+        type: string
+        format: date
+        required: false
+        description: Only transactions on or before this date.
+      - in: query
+        name: category_id
+        type: integer
+        required: false
+        description: Only transactions in this category.
+    responses:
+      200:
+        description: The user's full transaction history, oldest first, streamed as one JSON object per line or as CSV.
+      400:
+        description: Bad request, unknown format or invalid filter
+        schema:
+          type: object
+          properties:
+            error:
+              type: string
+              description: Error message
+      401:
+        description: Unauthorized, token is missing or invalid
+    """
+    user_id = current_user["id"]
+    export_format = request.args.get("format", "ndjson")
+
+    if export_format not in ("ndjson", "csv"):
+        return jsonify({"error": "Format must be 'ndjson' or 'csv'."}), 400
+
+    db = open_db()
+    transaction = Transaction(db)
+    try:
+        rows = transaction.iter_transactions(
+            user_id,
+            date_from=request.args.get("from"),
+            date_to=request.args.get("to"),
+            category_id=request.args.get("category_id", type=int),
+        )
+    except ValueError as ve:
+        db.close()
+        return jsonify({"error": str(ve)}), 400
+
+    # rows are read from the cursor while the response is being sent, memory stays flat
+    if export_format == "csv":
+        body, mimetype = _csv_lines(rows), "text/csv"
+    else:
+        body, mimetype = _ndjson_lines(rows), "application/x-ndjson"
+
+    return Response(
+        stream_with_context(closing_stream(db, body)),
+        mimetype=mimetype,
+        headers={"Content-Disposition": f"attachment; filename=transactions.{export_format}"},
+    )
+
+@dashboard_bp.route("/transactions/import", methods=["POST"])
+@limiter.limit("10 per minute", override_defaults=False)
+@token_required
+def import_transactions(current_user):
+    """
+    Import Transactions
+    ---
+    security:
+      - bearerAuth: []
+    consumes:
+      - application/json
+      - multipart/form-data
+      - text/csv
+    parameters:
+      - in: body
+        name: body
+        required: false
+        description: A JSON array of transactions (category_id, amount, description, date), or {"transactions" [...]}.
+        schema:
+          type: array
+          items:
+            type: object
+            properties:
+              category_id:
+                type: integer
+              amount:
+                type: number
+                format: float
+              description:
+                type: string
+              date:
+                type: string
+                format: date
+      - in: formData
+        name: file
+        type: file
+        required: false
+        description: A CSV file with the header category_id,amount,description,date. A raw text/csv body works too.
+    responses:
+      201:
+        description: Valid rows were imported in one batch, invalid ones are listed with their row index.
+        schema:
+          type: object
+          properties:
+            imported:
+              type: integer
+              description: Number of imported transactions
+            errors:
+              type: array
+              items:
+                type: object
+                properties:
+                  row:
+                    type: integer
+                  error:
+                    type: string
+      400:
+        description: Nothing could be imported, the body was empty or had no valid rows
+        schema:
+          type: object
+          properties:
+            error:
+              type: string
+              description: Error message
+      401:
+        description: Unauthorized, token is missing or invalid
+    """
+    user_id = current_user["id"]
+
+    transaction = Transaction()
+    try:
+        if request.is_json:
+            rows = request.get_json(silent=True)
+            if isinstance(rows, dict):
+                rows = rows.get("transactions")
+        else:
+            upload = request.files.get("file")
+            try:
+                text = upload.read().decode("utf-8-sig") if upload else request.get_data().decode("utf-8")
+            except UnicodeDecodeError:
+                raise ValueError("The file must be UTF-8 encoded CSV.")
+            rows = list(csv.DictReader(io.StringIO(text))) if text else None
+
+        result = transaction.import_transactions(user_id, rows)
+        if not result["imported"]:
+            return jsonify({"error": "No valid transactions to import.", **result}), 400
+
+        return jsonify(result), 201
 
     except ValueError as ve:
         return jsonify({"error": str(ve)}), 400
 
     except Exception as e:
         return jsonify({"error": "Something went wrong.", "details": str(e)}), 500
-    finally:
-      transaction.db.close()
 
 @dashboard_bp.route("/transactions/<int:transaction_id>", methods=["GET"])
 @token_required
@@ -473,8 +713,6 @@ def get_transaction_by_id(current_user, transaction_id):
     except Exception as e:
         print("Error:", str(e))  # Debugging
         return jsonify({"error": "Something went wrong.", "details": str(e)}), 500
-    finally:
-      transaction.db.close()
 
 @dashboard_bp.route("/update/<int:transaction_id>", methods=["PATCH"])
 @token_required
@@ -608,8 +846,6 @@ def update_transaction(current_user, transaction_id):
 
     except Exception as e:
         return jsonify({"error": "Something went wrong.", "message": str(e)}), 500
-    finally:
-      transaction.db.close()
       
 @dashboard_bp.route("/add_category", methods=["POST"])
 @token_required
@@ -695,8 +931,6 @@ def add_category(current_user):
 
     except Exception as e:
         return jsonify({"error": "Something went wrong.", "message": str(e)}), 500
-    finally:
-      transaction.db.close()
       
 @dashboard_bp.route("/chart/<chart_type>", methods=["GET"])
 @token_required
@@ -754,7 +988,7 @@ def display_chart(current_user, chart_type):
         if not user_id:
             return jsonify({"success": False, "error": "Unauthorized"}), 401
 
-        chart = Chart("file.db")
+        chart = Chart()
 
         if chart_type == "compare":
             data = chart.format_chart_data(user_id)
@@ -767,8 +1001,6 @@ def display_chart(current_user, chart_type):
 
     except Exception as e:
         return jsonify({"error": f"Internal server error: {str(e)}"}), 500
-    finally:
-      chart.db.close()
 
 @dutch_bp.route("/dutch", methods=["POST"])
 @token_required
@@ -801,6 +1033,13 @@ def create_group(current_user):
             spent:
               type: object
               description: Dictionary with spending data for each member
+            settlement_strategy:
+              type: string
+              enum:
+                - auto
+                - greedy
+                - exact
+              description: How debts are simplified. exact finds the fewest transfers for groups of up to 12 members with open balances (larger groups use greedy), greedy scales to large groups, auto (default) picks by group size.
           required:
             - name
             - total_amount
@@ -840,6 +1079,7 @@ def create_group(current_user):
     total_amount = data.get("total_amount")
     members = data.get("members")
     spent_dict = data.get("spent")
+    settlement_strategy = data.get("settlement_strategy", "auto")
     created_by = current_user["id"]
 
     # validate inputs
@@ -862,7 +1102,7 @@ def create_group(current_user):
 
     try:
         dutch = Dutch()
-        result = dutch.create_group(name, created_by, members, total_amount, spent_dict)
+        result = dutch.create_group(name, created_by, members, total_amount, spent_dict, settlement_strategy)
         if "error" in result:
             return jsonify(result), 400
 
@@ -873,8 +1113,6 @@ def create_group(current_user):
 
     except Exception as e:
         return jsonify({"error": "Something went wrong.", "details": str(e)}), 500
-    finally:
-      dutch.db.close()
 
 @dutch_bp.route("/dutch", methods=["GET"])
 @token_required
@@ -942,8 +1180,6 @@ def get_all_groups(current_user):
 
     except Exception as e:
         return jsonify({"error": "Something went wrong.", "details": str(e)}), 500
-    finally:
-      dutch.db.close()
 
 @dutch_bp.route("/dutch/<int:group_id>", methods=["GET"])
 @token_required
@@ -1019,26 +1255,26 @@ def get_group(user, group_id):
     """
     user_id = user["id"]
     dutch = Dutch()
-    try:
+
     # Get group basic info
-      group = dutch.get_group_by_id(user_id, group_id)
-      if "error" in group:
+    group = dutch.get_group_by_id(user_id, group_id)
+    if "error" in group:
         return jsonify(group), 404
 
     # Get members of the group
-      members_data = dutch.db.fetch_all(
+    members_data = dutch.db.fetch_all(
         """SELECT users.id, users.username 
         FROM group_members 
         JOIN users ON group_members.user_id = users.id 
         WHERE group_members.group_id = ?""",
         (group_id,),
-      )
-      members = [{"id": m["id"], "username": m["username"]} for m in members_data]
+    )
+    members = [{"id": m["id"], "username": m["username"]} for m in members_data]
 
-    # Run calculation
-      calculation = dutch.calculation(user_id, group_id)
+    # Stored settlement, only recalculated when members or spending changed since
+    calculation = dutch.get_settlements(user_id, group_id)
 
-      return (
+    return (
         jsonify(
             {
                 "group": {
@@ -1053,8 +1289,6 @@ def get_group(user, group_id):
         ),
         200,
     )
-    finally:
-      dutch.db.close()
 
 @dutch_bp.route("/dutch/<int:group_id>", methods=["PATCH"])
 @token_required
@@ -1095,6 +1329,13 @@ def update_group(user, group_id):
                 additionalProperties:
                   type: number
                 description: A dictionary of member IDs and their spending amounts
+              settlement_strategy:
+                type: string
+                enum:
+                  - auto
+                  - greedy
+                  - exact
+                description: Switch how the group's debts are simplified
     responses:
       200:
         description: Successfully updated the group information
@@ -1151,23 +1392,21 @@ def update_group(user, group_id):
     user_id = user["id"]
     dutch = Dutch()
     data = request.get_json()
-    try:
-      name = data.get("name")
-      total_amount = data.get("total_amount")
-      new_members = data.get("new_members")
-      member_spending = data.get("member_spending")
 
-      result = dutch.update_group_by_id(
-        user_id, group_id, name, total_amount, new_members, member_spending
-      )
+    name = data.get("name")
+    total_amount = data.get("total_amount")
+    new_members = data.get("new_members")
+    member_spending = data.get("member_spending")
+    settlement_strategy = data.get("settlement_strategy")
 
-      if "error" in result:
+    result = dutch.update_group_by_id(
+        user_id, group_id, name, total_amount, new_members, member_spending, settlement_strategy
+    )
+
+    if "error" in result:
         return jsonify(result), 400
-      
-      return jsonify(result), 200
-    
-    finally:
-      dutch.db.close()
+
+    return jsonify(result), 200
 
 @dutch_bp.route("/dutch/<int:group_id>", methods=["DELETE"])
 @token_required
@@ -1211,12 +1450,10 @@ def delete_group(user, group_id):
     """
     user_id = user["id"]
     dutch = Dutch()
-    try: 
-      result = dutch.delete_group_by_id(user_id, group_id)
 
-      if "error" in result:
+    result = dutch.delete_group_by_id(user_id, group_id)
+
+    if "error" in result:
         return jsonify(result), 403
-      
-      return jsonify(result), 200
-    finally:
-      dutch.db.close()
+
+    return jsonify(result), 200